@@ -1,79 +1,119 @@
 
 # -*- coding: utf-8 -*-
 
-import json
+import os
 
+import flask
 import dash
 from dash import html
 from dash import dcc
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 
-import pandas as pd
+import plotly.graph_objects as go
 
+import dataset
 import preprocess
+import selection
+import count_cube
+import spatial
+import figure_cache
+import metrics
+import latest
 import choropleth
 import arrond_map
 import bar_chart
-import swarmplot
 import warnings
 
 warnings.filterwarnings("ignore", category=RuntimeWarning) 
 
 app = dash.Dash(__name__)
 app.title = 'Projet | INF8808'
+# Les requêtes des callbacks sont numérotées par page (assets/latest.js) pour ne terminer que la dernière (latest)
+app.renderer = 'var renderer = new DashRenderer({request_pre: window.dash_latest.stamp});'
 
 server = app.server
 
-# Fichier geojson pour le choropleth
-with open('assets/montreal.json', encoding='utf-8') as data_file:
-    montreal_data = json.load(data_file)
-
-# Fichier contenant les données sur les arbres
-data = pd.read_csv('assets/arbres-publics.csv')
-
-# On enlève les outliers et on fait un prétraitement des données
-data = preprocess.removeOutliers(data)
-data = preprocess.preprocess_df(data)
-
-# Liste des espèces et liste des arrondissements du fichier geojson
-species = preprocess.getSpeciesList(data)
-locations = preprocess.get_neighborhoods(montreal_data)
-
-# Date de plantation minimale et maximale
-date_plantation_min = data['Date_plantation'].min()
-date_plantation_max = data['Date_plantation'].max()
-
-# Diamètre du tronc minimal et maximal
-dhp_min = data['DHP'].min()
-dhp_max = data['DHP'].max()
-
-# Arrondissement sélectionné par défaut
-arrondissement = 'Le Plateau-Mont-Royal'
-arrondissements = sorted(pd.unique(data['ARROND_NOM']))
-
-# Carte choroplèthe de la ville
-nb_arbres_arrondissement = preprocess.get_nb_trees_district(data, date_plantation_min, date_plantation_max, dhp_min, dhp_max)
-missing_arrondissement = preprocess.get_missing_districts(nb_arbres_arrondissement, locations)
-data_arrondissement = preprocess.add_density(nb_arbres_arrondissement, 'assets/montreal.json')
-choropleth_fig = choropleth.get_choropleth(data_arrondissement, missing_arrondissement, montreal_data, densite=False)
-
-# Carte des arbres de l'arrondissement
-carte_arrond = arrond_map.getMap(data, arrondissement, 'Date_plantation', (None, None, None, None, None))
-
-# Bar charts de la ville et de l'arrondissement
-bar_chart_ville = bar_chart.draw_bar_chart(data, None, 'Rue')
-bar_chart_arrond = bar_chart.draw_bar_chart(data, arrondissement, 'Rue')
-
-# Swarmplot des espèces d'arbres
-swarm_plot, especes, swarm = swarmplot.swarm(data)
+# Démarrage rapide (FAST_START=1) : la page est servie tout de suite avec des figures d'attente, et le jeu
+# de données et les figures initiales sont construits dans un thread (ou à la première requête qui en a besoin)
+FAST_START = os.environ.get('FAST_START', '0') == '1'
 
+# Les processus de calcul de growth_stats réimportent ce module sous le nom __mp_main__ : ils n'ont pas besoin du jeu de données
+if __name__ != '__mp_main__':
+    if FAST_START:
+        dataset.start_warm_up()
+    else:
+        dataset.get()
+
+
+# Rechargement à chaud (DATA_RELOAD_SECONDS > 0) : le fichier source est surveillé par un thread dans chaque
+# worker, démarré à sa première requête (après le fork de gunicorn, qui ne garde pas les threads du master)
+@server.before_request
+def start_watcher():
+    dataset.start_watcher()
+
+# Figures de la page
+FIGURES = ['choropleth', 'carte_arrond', 'barChartVille', 'barChartArrond', 'swarm_plot']
+
+# Critères des listes déroulantes des figures
+CRITERES_CHOROPLETH = ["Nombre d'arbres", "Densité d'arbres"]
+CRITERES_CARTE = {"Date_plantation": "Date de plantation",
+                  "Date_releve": "Date de relevé",
+                  "DHP": "Diamètre du tronc"}
+CRITERES_BAR_CHART = {"Rue": "Rues",
+                      "Emplacement": "Emplacements",
+                      "Essence_fr": "Espèces"}
+# Largeur maximale de l'intervalle de confiance de la vitesse de croissance des espèces du swarmplot (0 : toutes les espèces)
+INTERVALLES_SWARM = [{'label': 'Toutes les espèces', 'value': 0},
+                     {'label': 'Intervalle de moins de 1 cm/an', 'value': 1},
+                     {'label': 'Intervalle de moins de 0,5 cm/an', 'value': 0.5},
+                     {'label': 'Intervalle de moins de 0,25 cm/an', 'value': 0.25}]
+
+# Valeurs initiales des curseurs (sans filtre)
+DATE_RANGE = selection.DATE_RANGE
+DHP_RANGE = selection.DHP_RANGE
+
+
+def get_default_states(bundle):
+    # États (nom du cache, entrées) des figures sans filtre, pré-rendus par figure_store
+    filters = (DATE_RANGE, DHP_RANGE, None)
+    states = [('choropleth', (critere, *filters, timeline)) for critere in CRITERES_CHOROPLETH for timeline in ([], ['timeline'])]
+    for arrondissement in [arrond_map.CITY] + bundle['arrondissements']:
+        default_zoom = spatial.CITY_ZOOM if arrondissement == arrond_map.CITY else spatial.DEFAULT_ZOOM
+        states += [('carte_arrond', (critere, arrondissement, *filters, spatial.get_lod(default_zoom), None)) for critere in CRITERES_CARTE]
+    states += [('barChartVille', (critere, *filters)) for critere in CRITERES_BAR_CHART]
+    states += [('barChartArrond', (arrondissement, critere, *filters))
+               for arrondissement in bundle['arrondissements'] for critere in CRITERES_BAR_CHART]
+
+    return states
+
+
+def get_placeholder():
+    # Figure d'attente affichée pendant la construction du jeu de données
+    fig = go.Figure()
+    fig.add_annotation(text="Chargement...",
+                    font=dict(size=15),
+                    xref="paper", yref="paper",
+                    x=0.5, y=0.5,
+                    showarrow=False,
+                    align="center")
+    fig.update_xaxes(showticklabels=False, showgrid=False, visible=False)
+    fig.update_yaxes(showticklabels=False, showgrid=False, visible=False)
+    fig.update_layout(dragmode=False, plot_bgcolor='white')
+
+    return fig
+
+
+def get_sections(bundle):
+    # Sections de la page ; sans jeu de données (démarrage rapide), des figures d'attente et des listes vides
+    if bundle is not None:
+        figures, species, arrondissements, especes = bundle['figures'], bundle['species'], bundle['arrondissements'], bundle['especes']
+    else:
+        figures, species, arrondissements, especes = {name: get_placeholder() for name in FIGURES}, [], [], []
+    choropleth_fig, carte_arrond = figures['choropleth'], figures['carte_arrond']
+    bar_chart_ville, bar_chart_arrond, swarm_plot = figures['barChartVille'], figures['barChartArrond'], figures['swarm_plot']
 
-app.layout = html.Div(className='content', children=[
-    html.Header(children=[
-        html.H1(html.Strong('Les arbres de la Ville de Montréal')),
-    ]),
-    
-    html.Main(className='viz-container', children=[
+    return [
         
         # Section cartes de la ville et de l'arrondissement
         html.Div(id='maps', children=[
@@ -93,10 +133,10 @@ app.layout = html.Div(className='content', children=[
                     html.H6('Date de plantation'),
                     dcc.RangeSlider(
                         id='dateSlider', className='slider',
-                        min=1960,
-                        max=2023,
+                        min=DATE_RANGE[0],
+                        max=DATE_RANGE[1],
                         step=1,
-                        value=[1960, 2023],
+                        value=DATE_RANGE,
                         allowCross=False,  
                         marks=None,  
                         tooltip={
@@ -110,10 +150,10 @@ app.layout = html.Div(className='content', children=[
                     html.H6('Diamètre du tronc (cm)'),
                     dcc.RangeSlider(
                         id='diametreSlider', className='slider',
-                        min=0,
-                        max=300,
+                        min=DHP_RANGE[0],
+                        max=DHP_RANGE[1],
                         step=1,
-                        value=[0, 300],
+                        value=DHP_RANGE,
                         allowCross=False,  
                         marks=None, 
                         tooltip={
@@ -139,31 +179,37 @@ app.layout = html.Div(className='content', children=[
                                 html.P('Critère d\'échelle :')
                             ]),
                             dcc.Dropdown(id='critere_choropleth',
-                                options=["Nombre d'arbres", "Densité d'arbres"],
+                                options=CRITERES_CHOROPLETH,
                                 value="Nombre d'arbres",
                                 placeholder='Critère',
                                 multi=False,
                                 searchable=False,
-                                clearable=False)
+                                clearable=False),
+                            # Animation année par année du nombre cumulé d'arbres depuis la première année du curseur
+                            dcc.Checklist(id='timeline_choropleth',
+                                options={'timeline': 'Évolution par année'},
+                                value=[])
                             ],
                             style={"margin" : "10px", "width": "47%", "height": "36px"},)    
             ]),
 
             # Carte des arbres de l'arrondissement
             html.Div(id='arrond', children=[
+                        # La figure est envoyée avec ses hovers encodés dans carte_arrond_encoded, puis décodée dans le navigateur
                         dcc.Loading(
-                            children=dcc.Graph(figure=carte_arrond, id='carte_arrond',
-                                config=dict(scrollZoom=True, displayModeBar=False)),   
+                            children=[dcc.Graph(id='carte_arrond',
+                                config=dict(scrollZoom=True, displayModeBar=False)),
+                                dcc.Store(id='carte_arrond_encoded', data=carte_arrond)],
                             style={'margin-top': '500px'}                         
                         ),
+                        # Dernière vue de la carte (zoom, rectangle visible) et arrondissement où elle a été relevée
+                        dcc.Store(id='carte_arrond_view'),
                         html.Div(id='div_critere_carte_arrond', children=[
                             html.Div(id='text_critere_carte_arrond', children=[
                                 html.P('Critère d\'échelle :')
                             ]),
                             dcc.Dropdown(id='critere_carte_arrond',
-                                options={"Date_plantation": "Date de plantation",
-                                         "Date_releve": "Date de relevé",
-                                         "DHP": "Diamètre du tronc"},
+                                options=CRITERES_CARTE,
                                 value="Date_plantation",
                                 placeholder='Critère',
                                 multi=False,
@@ -173,7 +219,7 @@ app.layout = html.Div(className='content', children=[
                                 html.P('Arrondissement :')
                             ]),
                             dcc.Dropdown(id='arr_carte_arrond',
-                                options=arrondissements,
+                                options=[arrond_map.CITY] + arrondissements,
                                 value="Le Plateau-Mont-Royal",
                                 multi=False,
                                 searchable=False,
@@ -198,9 +244,7 @@ app.layout = html.Div(className='content', children=[
                                 html.P('Critère classement :')
                             ]),
                             dcc.Dropdown(id='critere_bar_chart_ville',
-                                options={"Rue": "Rues",
-                                         "Emplacement": "Emplacements",
-                                         "Essence_fr": "Espèces"},
+                                options=CRITERES_BAR_CHART,
                                 value="Rue",
                                 placeholder='Critère',
                                 multi=False,
@@ -222,9 +266,7 @@ app.layout = html.Div(className='content', children=[
                                 html.P('Critère classement :')
                             ]),
                             dcc.Dropdown(id='critere_bar_chart_arrond',
-                                options={"Rue": "Rues",
-                                         "Emplacement": "Emplacements",
-                                         "Essence_fr": "Espèces"},
+                                options=CRITERES_BAR_CHART,
                                 value="Rue",
                                 placeholder='Critère',
                                 multi=False,
@@ -254,6 +296,13 @@ app.layout = html.Div(className='content', children=[
                         multi=False,
                         searchable=True,
                         clearable=True),
+                    # Espèces dont l'intervalle de confiance de la vitesse de croissance est trop large, masquées dans le navigateur
+                    dcc.Dropdown(id='intervalle_swarm',
+                        options=INTERVALLES_SWARM,
+                        value=0,
+                        multi=False,
+                        searchable=False,
+                        clearable=False),
                     html.Button(id='btn_info_3', n_clicks=0, children='i'),
                     html.Div(id='texte_especes_arbres', style={'display': 'flex', 'justify-content': 'flex-end', 'align-items': 'center', "fontSize": "10px"}, children=[
                         html.H2("Espèces\nd'arbres")
@@ -302,6 +351,7 @@ app.layout = html.Div(className='content', children=[
         html.Div(id='info_tooltip_3', style={'display': 'none'}, children=[
             html.P("Ce graphique représente la vitesse moyenne de croissance du tronc et le diamètre moyen du tronc de chaque espèce d'arbre de la Ville de Montréal."),
             html.P("Chaque bulle correspond à une espèce d'arbre, sa position le long de l'axe des abscisses correspond à sa vitesse moyenne de croissance du tronc et sa taille correspond au diamètre de son tronc."),
+            html.P("Quand on passe la souris sur une bulle, l'intervalle de confiance à 95 % de la vitesse de croissance est affiché : plus l'espèce a peu d'arbres, plus il est large. Les espèces dont l'intervalle est trop large pour que leur vitesse soit fiable peuvent être masquées."),
             html.P("Vous pouvez mettre en évidence une espèce d'arbre grâce à l'outil de recherche en haut à gauche.")
         ]),
         
@@ -312,8 +362,40 @@ app.layout = html.Div(className='content', children=[
             html.P('Le jeu de données comptabilise plus de 350 000 arbres et couvre une période allant de 1960 jusqu\'à aujourd\'hui.'),
             html.P('Un prétraitement a été effectué sur les données afin de ne garder que les arbres ayant leurs attributs valides (dates, espèce, diamètre du tronc...).')
         ]),
+    ]
+
+
+def serve_layout():
+    # Mise en page servie à chaque chargement : les figures d'attente sont remplacées dès que le jeu de données est prêt
+    bundle = dataset.peek()
+
+    return html.Div(className='content', children=[
+        html.Header(children=[
+            html.H1(html.Strong('Les arbres de la Ville de Montréal')),
+        ]),
+
+        html.Main(id='main', className='viz-container', children=get_sections(bundle)),
+
+        dcc.Interval(id='warm_up', interval=1000, disabled=bundle is not None),
     ])
-])
+
+
+app.layout = serve_layout
+
+
+# Callback de fin du démarrage rapide : affiche les vraies figures quand le jeu de données est prêt
+@app.callback(
+    Output('main', 'children'),
+    Output('warm_up', 'disabled'),
+    Input('warm_up', 'n_intervals'),
+    prevent_initial_call=True
+)
+def show_figures(n_intervals):
+    bundle = dataset.peek()
+    if bundle is None:
+        raise PreventUpdate
+
+    return get_sections(bundle), True
 
 
 # Callback bouton d'information des cartes
@@ -356,67 +438,159 @@ def toggle_tooltip(n_clicks):
     Input('dateSlider', 'value'),
     Input('diametreSlider', 'value'),
     Input('specie', 'value'),
+    Input('timeline_choropleth', 'value'),
     prevent_initial_call=True
 )
-def update_maps(critere_choropleth, date_range, dhp_range, specie):
+@metrics.instrument('choropleth')
+@latest.latest_wins('choropleth')
+@figure_cache.cached('choropleth')
+def update_maps(critere_choropleth, date_range, dhp_range, specie, timeline):
+    bundle = dataset.get()
     densite = critere_choropleth == "Densité d'arbres"
-    nb_arbres_arrondissement = preprocess.get_nb_trees_district(data, pd.to_datetime(str(date_range[0]), format='%Y'), \
-                                                                pd.to_datetime(str(date_range[1] + 1), format='%Y'), \
-                                                                dhp_range[0], dhp_range[1], specie)
-    missing_arrondissement = preprocess.get_missing_districts(nb_arbres_arrondissement, locations)
-    data_arrondissement = preprocess.add_density(nb_arbres_arrondissement, 'assets/montreal.json')
-    choropleth_updated = choropleth.get_choropleth(data_arrondissement, missing_arrondissement, montreal_data, densite=densite)
+    if timeline:
+        return get_choropleth_timeline(bundle, densite, date_range, dhp_range, specie)
+    _, min_date_plantation, max_date_plantation, min_dhp, max_dhp = selection.get_filter(specie, date_range, dhp_range)
+    with metrics.timer('query'):
+        nb_arbres_arrondissement = count_cube.get_nb_trees_district(bundle['cube'], bundle['data'], min_date_plantation, max_date_plantation,
+                                                                    min_dhp, max_dhp, specie)
+    latest.check()
+    missing_arrondissement = preprocess.get_missing_districts(nb_arbres_arrondissement, bundle['districts'])
+    data_arrondissement = preprocess.add_density(nb_arbres_arrondissement, bundle['districts'])
+    choropleth_updated = choropleth.get_choropleth(data_arrondissement, missing_arrondissement, bundle['montreal_geometry'], densite=densite)
                         
     return choropleth_updated
 
-# Callback graphique carte des arbres de l'arrondissement
+def get_choropleth_timeline(bundle, densite, date_range, dhp_range, specie):
+    # Nombre cumulé d'arbres par arrondissement depuis la première année du curseur jusqu'à chacune de ses années,
+    # en une seule requête sur le cube (la dernière année donne la carte sans animation)
+    cube = bundle['cube']
+    years = list(range(int(date_range[0]), int(date_range[1]) + 1))
+    with metrics.timer('query'):
+        counts = count_cube.get_cumulative_counts(cube, bundle['data'], years, dhp_range[0], dhp_range[1], specie)
+    latest.check()
+
+    district_names = cube['districts']['ARROND_NOM'].astype(str).to_numpy()
+    areas = bundle['districts'].set_index('NOM')['AIRE'].reindex(district_names).to_numpy()
+    missing_arrondissement = preprocess.get_missing_districts(cube['districts'], bundle['districts'])
+
+    return choropleth.get_choropleth_timeline(district_names, areas, counts, years, missing_arrondissement, bundle['montreal_geometry'], densite=densite)
+
+# Vue de la carte relevée dans le navigateur : un changement d'arrondissement ne déclenche pas de relayoutData,
+# on garde donc l'arrondissement avec la vue pour ignorer une vue périmée
+app.clientside_callback(
+    ClientsideFunction(namespace='carte', function_name='view'),
+    Output('carte_arrond_view', 'data'),
+    Input('carte_arrond', 'relayoutData'),
+    State('arr_carte_arrond', 'value'),
+    prevent_initial_call=True
+)
+
+# Callback graphique carte des arbres de l'arrondissement (le niveau de détail et les arbres retenus dépendent de la vue de la carte)
 @app.callback(
-    Output('carte_arrond', 'figure'),
+    Output('carte_arrond_encoded', 'data'),
     Input('critere_carte_arrond', 'value'),
     Input('arr_carte_arrond', 'value'),
     Input('dateSlider', 'value'),
     Input('diametreSlider', 'value'),
     Input('specie', 'value'),
+    Input('carte_arrond_view', 'data'),
     prevent_initial_call=True
 )
-def update_maps(critere_carte_arrond, arr_carte_arrond, date_range, dhp_range, specie):           
-    arrond_map_updated = arrond_map.getMap(data, arr_carte_arrond, critere_carte_arrond, (specie, pd.to_datetime(str(date_range[0]), format='%Y'), pd.to_datetime(str(date_range[1] + 1), format='%Y'), dhp_range[0], dhp_range[1]))
+@metrics.instrument('carte_arrond')
+@latest.latest_wins('carte_arrond')
+def update_maps(critere_carte_arrond, arr_carte_arrond, date_range, dhp_range, specie, view):
+    relayout_data = view['relayout'] if view and view['arrondissement'] == arr_carte_arrond else None
+    default_zoom = spatial.CITY_ZOOM if arr_carte_arrond == arrond_map.CITY else spatial.DEFAULT_ZOOM
+    lod = spatial.get_lod(spatial.get_zoom(relayout_data, default_zoom))
+    bbox = spatial.get_viewport(relayout_data)
+
+    return get_carte_arrond(critere_carte_arrond, arr_carte_arrond, date_range, dhp_range, specie, lod, bbox)
+
+@figure_cache.cached('carte_arrond')
+def get_carte_arrond(critere_carte_arrond, arr_carte_arrond, date_range, dhp_range, specie, lod, bbox):
+    bundle = dataset.get()
+    arrond_map_updated = arrond_map.getMap(bundle['data'], arr_carte_arrond, critere_carte_arrond, selection.get_filter(specie, date_range, dhp_range), bundle['index'], bundle['grid'], lod, bundle['spatial_index'], bbox)
         
     return arrond_map_updated
 
-# Callback graphique bar chart ville
+# Décodage des hovers de la carte des arbres dans le navigateur (aussi au chargement de la figure initiale)
+app.clientside_callback(
+    ClientsideFunction(namespace='carte', function_name='decode'),
+    Output('carte_arrond', 'figure'),
+    Input('carte_arrond_encoded', 'data')
+)
+
+# Callback graphique bar chart ville (avec les mêmes filtres que les cartes)
 @app.callback(
     Output('barChartVille', 'figure'),
     Input('critere_bar_chart_ville', 'value'),
+    Input('dateSlider', 'value'),
+    Input('diametreSlider', 'value'),
+    Input('specie', 'value'),
     prevent_initial_call=True
 )
-def update_maps(critere_bar_chart_ville):
-    bar_chart_ville_updated = bar_chart.draw_bar_chart(data, None, critere_bar_chart_ville)
+@metrics.instrument('barChartVille')
+@latest.latest_wins('barChartVille')
+@figure_cache.cached('barChartVille')
+def update_maps(critere_bar_chart_ville, date_range, dhp_range, specie):
+    bundle = dataset.get()
+    bar_chart_ville_updated = bar_chart.draw_bar_chart(bundle['data'], None, critere_bar_chart_ville, bundle['index'], bundle['rankings'], selection.get_filter(specie, date_range, dhp_range))
     
     return bar_chart_ville_updated
 
-# Callback graphique bar chart arrondissement
+# Callback graphique bar chart arrondissement (avec les mêmes filtres que les cartes)
 @app.callback(
     Output('barChartArrond', 'figure'),
     Input('arr_bar_chart_arrond', 'value'),
     Input('critere_bar_chart_arrond', 'value'),
+    Input('dateSlider', 'value'),
+    Input('diametreSlider', 'value'),
+    Input('specie', 'value'),
     prevent_initial_call=True
 )
-def update_maps(arr_bar_chart_arrond, critere_bar_chart_arrond):
-    bar_chart_arrond_updated = bar_chart.draw_bar_chart(data, arr_bar_chart_arrond, critere_bar_chart_arrond)
+@metrics.instrument('barChartArrond')
+@latest.latest_wins('barChartArrond')
+@figure_cache.cached('barChartArrond')
+def update_maps(arr_bar_chart_arrond, critere_bar_chart_arrond, date_range, dhp_range, specie):
+    bundle = dataset.get()
+    bar_chart_arrond_updated = bar_chart.draw_bar_chart(bundle['data'], arr_bar_chart_arrond, critere_bar_chart_arrond, bundle['index'], bundle['rankings'], selection.get_filter(specie, date_range, dhp_range))
     
     return bar_chart_arrond_updated
 
-# Callback graphique swarmplot
-@app.callback(
+# Callback graphique swarmplot : la mise en évidence et le masquage des espèces se font dans le navigateur, sans appel au serveur
+app.clientside_callback(
+    ClientsideFunction(namespace='swarm', function_name='highlight'),
     Output('swarm_plot', 'figure'),
     Input('espece_swarm', 'value'),
+    Input('intervalle_swarm', 'value'),
+    State('swarm_plot', 'figure'),
     prevent_initial_call=True
 )
-def update_swarm(espece_swarm):
-    swarm_plot_updated = swarmplot.swarmPlot(swarm_plot, swarm, espece_swarm)
 
-    return swarm_plot_updated
+
+# État du démarrage : 200 quand le jeu de données et les figures initiales sont prêts, 503 sinon
+@server.route('/_ready')
+def ready():
+    bundle = dataset.peek()
+    if bundle is None:
+        return flask.jsonify(ready=False), 503
+
+    return flask.jsonify(ready=True, version=bundle['version'])
+
+
+# Statistiques du cache des figures (succès, échecs, évictions)
+@server.route('/_figure-cache')
+def figure_cache_stats():
+    return flask.jsonify(figure_cache.get_stats())
+
+
+# Mesures des callbacks au format Prometheus, propres à chaque worker (404 sans METRICS=1)
+@server.route('/metrics')
+def metrics_text():
+    if not metrics.ENABLED:
+        flask.abort(404)
+
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
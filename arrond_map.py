@@ -1,5 +1,15 @@
+import numpy as np
+import pandas as pd
 import plotly.express as px
 
+import latest
+import metrics
+import selection
+import spatial
+
+# Choix de la liste des arrondissements pour la carte de toute la ville
+CITY = 'Toute la ville'
+
 def get_arrondissement_hover_template():
     hover_template = (
         '<b>Espèce</b> : <span font-weight: normal">%{customdata[0]}</span><br>' +
@@ -10,23 +20,73 @@ def get_arrondissement_hover_template():
     
     return hover_template
 
-def getMap(data, arrondissement, critere, filter):
-    espece, min_date_plantation, max_date_plantation, min_dhp, max_dhp = filter
-    
-    # Sélectionner les arbres de l'arrondissement
-    data = data[data['ARROND_NOM'] == arrondissement]
+# Données des hovers des arbres, encodées pour alléger la figure : chaque arbre n'envoie que le code
+# de son espèce (rang dans la liste especes, envoyée une fois avec la trace), ses dates de plantation
+# et de relevé en jours depuis le 1970-01-01 et son DHP. La fonction carte.decode de assets/clientside.js
+# remet les noms et les dates en texte avant l'affichage, pour le même hover_template.
+def get_hover_data(data):
+    codes, especes = pd.factorize(data['Essence_fr'])
+    plantation = data['Date_plantation'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    releve = data['Date_releve'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    dhp = data['DHP'].to_numpy()
+    # Un DHP entier est envoyé sans décimale
+    if np.all(np.mod(dhp, 1) == 0):
+        dhp = dhp.astype(np.int64)
+    customdata = np.column_stack([codes, plantation, releve, dhp])
+
+    return customdata, [str(espece) for espece in especes]
+
+def get_cluster_hover_template(title):
+    hover_template = (
+        '<b>Nombre d\'arbres</b> : <span font-weight: normal">%{customdata[0]}</span><br>' +
+        f'<b>{title} (moyenne)</b> : <span font-weight: normal">%{{customdata[1]:.0f}}</span><br>' +
+        '<extra></extra>'
+    )
     
-    # Filtrer les données en fonction des espèces
-    if espece:
-        data = data[data['Essence_fr'] == espece]
+    return hover_template
+
+# Avec l'index et la grille, lod donne le niveau de détail voulu (spatial.get_lod) : loin de la carte,
+# les arbres sont regroupés par cellule de la grille. Avec l'index spatial, bbox (spatial.get_viewport)
+# limite la carte aux arbres du rectangle visible. arrondissement peut être CITY pour toute la ville.
+def getMap(data, arrondissement, critere, filter, index=None, grid=None, lod=None, spatial_index=None, bbox=None):
+    espece, min_date_plantation, max_date_plantation, min_dhp, max_dhp = filter
+    city = arrondissement == CITY
+    if spatial_index is None:
+        bbox = None
     
-    # Filtrer les données en fonction des dates de plantation
-    if min_date_plantation != None and max_date_plantation != None:
-        data = data[(data['Date_plantation'] >= min_date_plantation) & (data['Date_plantation'] <= max_date_plantation)]
-       
-    # Filtrer les données en fonction des dates de relevé
-    if min_dhp != None and max_dhp != None:
-        data = data[(data['DHP'] >= min_dhp) & (data['DHP'] <= max_dhp)]
+    # Sélection des arbres, mesurée comme phase de requête
+    with metrics.timer('query'):
+        # Sélectionner les arbres de l'arrondissement qui respectent le filtre, avec l'index s'il est fourni
+        if index is not None and city:
+            # Toute la ville : les arbres du rectangle visible, puis le filtre sur ceux-ci seulement
+            mask = selection.get_mask(index, filter)
+            rows = spatial.query_bbox(spatial_index, bbox) if bbox is not None else np.arange(len(data), dtype=np.int32)
+            rows = rows[mask[rows]]
+            data = data.iloc[rows]
+        elif index is not None:
+            rows = selection.get_rows(index, arrondissement, filter)
+            if bbox is not None:
+                rows = spatial.crop(spatial_index, rows, bbox)
+            data = data.iloc[rows]
+        else:
+            # Sélectionner les arbres de l'arrondissement
+            if not city:
+                data = data[data['ARROND_NOM'] == arrondissement]
+        
+            # Filtrer les données en fonction des espèces
+            if espece:
+                data = data[data['Essence_fr'] == espece]
+        
+            # Filtrer les données en fonction des dates de plantation
+            if min_date_plantation != None and max_date_plantation != None:
+                data = data[(data['Date_plantation'] >= min_date_plantation) & (data['Date_plantation'] <= max_date_plantation)]
+           
+            # Filtrer les données en fonction des dates de relevé
+            if min_dhp != None and max_dhp != None:
+                data = data[(data['DHP'] >= min_dhp) & (data['DHP'] <= max_dhp)]
+    metrics.add('rows', len(data))
+    # La construction de la figure n'est pas faite si une requête plus récente l'a remplacée
+    latest.check()
     
     # Légende de l'échelle de couleur    
     if critere == 'Date_plantation':
@@ -39,8 +99,14 @@ def getMap(data, arrondissement, critere, filter):
     # Couleur des points en fonction du critère
     color = data[critere].dt.year if critere in ['Date_plantation', 'Date_releve'] else data[critere]
     
-    # S'il n'y a pas d'arbre, on affiche un texte
-    if data.empty:
+    # Zoom initial de la carte
+    zoom = spatial.CITY_ZOOM if city else spatial.DEFAULT_ZOOM
+    
+    # Niveau de détail : arbres un par un ou regroupés par cellule de la grille
+    level = spatial.get_level(grid, rows, lod) if index is not None and grid is not None and lod is not None else spatial.POINTS
+    
+    # S'il n'y a pas d'arbre, on affiche un texte (sauf dans un rectangle visible vide, où la carte reste affichée pour s'y déplacer)
+    if data.empty and bbox is None:
         fig = px.scatter()
         fig.add_annotation(text="Aucun arbre à afficher.",
                         font=dict(size=15),
@@ -52,16 +118,27 @@ def getMap(data, arrondissement, critere, filter):
         fig.update_yaxes(showticklabels=False, showgrid=False, visible=False)
         fig.update_layout(dragmode = False)    
         
+    # Si on est trop loin, on affiche les groupes d'arbres
+    elif level != spatial.POINTS:
+        clusters = spatial.cluster(grid, rows, data, color, level)
+        fig = px.scatter_mapbox(clusters, color='Moyenne', size='Nombre_Arbres', lat='Latitude', lon='Longitude', size_max=25,
+                                zoom=zoom, color_continuous_scale='tempo', custom_data=['Nombre_Arbres', 'Moyenne'])
+        fig.update_layout(mapbox_style="open-street-map", coloraxis_colorbar=dict(title=title))
+        fig.update_traces(hovertemplate=get_cluster_hover_template(title))
+        
     # Sinon, on affiche la carte avec les arbres
     else:
+        # Hovers encodés (codes des espèces, jours des dates), décodés dans le navigateur avec la table de la trace
+        customdata, especes = get_hover_data(data)
         fig = px.scatter_mapbox(data, color=color, lat='Latitude', lon='Longitude', 
-                                zoom=12.5, color_continuous_scale='tempo', hover_data=['Essence_fr', 'Date_plantation_format', 'Date_releve_format', 'DHP'])
+                                zoom=zoom, color_continuous_scale='tempo')
         fig.update_layout(mapbox_style="open-street-map", coloraxis_colorbar=dict(title=title))
-        fig.update_traces(hovertemplate=get_arrondissement_hover_template())
+        fig.update_traces(customdata=customdata, meta={'especes': especes}, hovertemplate=get_arrondissement_hover_template())
     
-    # Mise en page de la carte
+    # Mise en page de la carte (le zoom et la position de l'utilisateur sont gardés tant que l'arrondissement ne change pas)
     fig.update_layout(
-        title=f"<b>Vue de l'arrondissement {arrondissement}</b>",
+        uirevision=arrondissement,
+        title="<b>Vue de toute la ville</b>" if city else f"<b>Vue de l'arrondissement {arrondissement}</b>",
         title_x=0.5,
         coloraxis_colorbar_thickness=23,
         margin=dict(l=60, r=60, t=60, b=60),
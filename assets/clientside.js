@@ -0,0 +1,75 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    swarm: {
+        // Met en évidence une espèce d'arbre en grisant toutes les autres espèces, et masque les espèces
+        // dont l'intervalle de confiance de la vitesse de croissance est plus large que maxWidth (0 : aucune),
+        // directement dans la figure déjà chargée (même couleur que swarmplot.swarm)
+        highlight: function(specie, maxWidth, figure) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            var color = '#36749d';
+            var grey = 'lightgray';
+
+            // Les bulles sont dans le même ordre que les espèces de la trace des hovers
+            var index = figure.data.findIndex(function(trace) { return trace.customdata; });
+            var trace = figure.data[index];
+            var colors = trace.customdata.map(function(row) {
+                return !specie || row[0] === specie ? color : grey;
+            });
+            // Intervalle [customdata[4], customdata[5]] : NaN pour une espèce d'un seul arbre, reçu comme null
+            // (null - null vaut 0 en JavaScript, on teste donc les bornes manquantes à part)
+            var hidden = trace.customdata.map(function(row) {
+                return maxWidth > 0 && (row[4] === null || row[5] === null || row[5] - row[4] > maxWidth);
+            });
+
+            // Une bulle masquée n'a plus de position y (ni bulle ni hover), rétablie depuis meta
+            var y = trace.meta && trace.meta.y ? trace.meta.y.map(function(value, i) {
+                return hidden[i] ? null : value;
+            }) : trace.y;
+
+            // Bulles dessinées par la trace de marqueurs
+            var data = figure.data.slice();
+            if (trace.marker && Array.isArray(trace.marker.color)) {
+                data[index] = Object.assign({}, trace, {y: y, marker: Object.assign({}, trace.marker, {color: colors})});
+                return Object.assign({}, figure, {data: data});
+            }
+
+            // Bulles dessinées par les premières formes de la figure
+            data[index] = Object.assign({}, trace, {y: y});
+            var shapes = figure.layout.shapes.map(function(shape, i) {
+                return i < colors.length ? Object.assign({}, shape, {fillcolor: colors[i], visible: !hidden[i]}) : shape;
+            });
+            return Object.assign({}, figure, {data: data, layout: Object.assign({}, figure.layout, {shapes: shapes})});
+        }
+    },
+    carte: {
+        // Garde la dernière vue de la carte (zoom, rectangle visible) avec l'arrondissement affiché,
+        // en ignorant les événements qui ne déplacent pas la carte (redimensionnement, etc.)
+        view: function(relayout, arrondissement) {
+            if (!relayout || !('mapbox.zoom' in relayout || 'mapbox._derived' in relayout)) {
+                return window.dash_clientside.no_update;
+            }
+            return {arrondissement: arrondissement, relayout: relayout};
+        },
+        // Décode les hovers des arbres envoyés par arrond_map.get_hover_data : code de l'espèce
+        // dans la table de la trace et dates en jours depuis le 1970-01-01
+        decode: function(figure) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            var day = 24 * 60 * 60 * 1000;
+            var format = function(days) { return new Date(days * day).toISOString().slice(0, 10); };
+            var data = (figure.data || []).map(function(trace) {
+                if (!trace.meta || !trace.meta.especes || !trace.customdata) {
+                    return trace;
+                }
+                var especes = trace.meta.especes;
+                var customdata = trace.customdata.map(function(row) {
+                    return [especes[row[0]], format(row[1]), format(row[2]), row[3]];
+                });
+                return Object.assign({}, trace, {customdata: customdata});
+            });
+            return Object.assign({}, figure, {data: data});
+        }
+    }
+});
@@ -0,0 +1,10 @@
+// Numérote les requêtes des callbacks de la page avant leur envoi (hook request_pre du renderer de Dash) :
+// le serveur ne termine que la dernière requête de la page pour chaque sortie (voir latest.py)
+window.dash_latest = {
+    page: Math.random().toString(36).slice(2) + Date.now().toString(36),
+    sequence: 0,
+    stamp: function(payload) {
+        window.dash_latest.sequence += 1;
+        payload.latest = {page: window.dash_latest.page, sequence: window.dash_latest.sequence};
+    }
+};
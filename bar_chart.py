@@ -1,6 +1,13 @@
+import pandas as pd
 import plotly.express as px
 
-def draw_bar_chart(data, arrond, criterion):
+import metrics
+import rankings as rankings_module
+import tree_index
+
+# Avec les classements calculés au chargement (rankings), le top 10 est lu dans la table, ou calculé sur les
+# arbres retenus par le filtre (espèce, dates de plantation, DHP) comme pour les cartes.
+def draw_bar_chart(data, arrond, criterion, index=None, rankings=None, filter=None):
     # On modifie le nom du critère pour le titre
     if criterion == 'Rue':
         pretty_criterion = 'Rues'
@@ -11,18 +18,29 @@ def draw_bar_chart(data, arrond, criterion):
     
     # On adapte le titre si c'est la carte de l'arrondissement ou de la ville
     if arrond:
-        data = data[data['ARROND_NOM'] == arrond]
+        if rankings is None:
+            data = data.iloc[tree_index.get_district_rows(index, arrond)] if index is not None else data[data['ARROND_NOM'] == arrond]
         title = f"<b>Top 10 {pretty_criterion.lower()} de l'arrondissement {arrond}</b>"
         if len(title) > 65:
             title = f"<b>Top 10 {pretty_criterion.lower()} de l'arrondissement<br>{arrond}</b>"    
     else:
         title = f"<b>Top 10 {pretty_criterion.lower()} de la Ville de Montréal</b>"
     
-    # On compte le nombre d'arbres pour chaque catégorie du critère    
-    tree_counts = data.groupby(criterion).size().reset_index(name='Count')
-    
-    # On trie et on garde le top 10
-    top_10_tree_counts = tree_counts.sort_values(by='Count').tail(10)
+    if rankings is not None:
+        # Top 10 lu dans les classements, ou calculé sur les arbres retenus par le filtre
+        with metrics.timer('query'):
+            names, counts = rankings_module.get_top_k(rankings, index, arrond, criterion, filter)
+        top_10_tree_counts = pd.DataFrame({criterion: names, 'Count': counts})
+    else:
+        # On compte le nombre d'arbres pour chaque catégorie du critère    
+        with metrics.timer('query'):
+            tree_counts = data.groupby(criterion, observed=True).size().sort_index().reset_index(name='Count')
+        metrics.add('rows', len(data))
+        
+        # On trie (tri stable, les égalités restent dans l'ordre alphabétique) et on garde le top 10
+        # (en texte pour garder l'ordre du tri si le critère est une catégorie)
+        top_10_tree_counts = tree_counts.sort_values(by='Count', kind='mergesort').tail(10)
+        top_10_tree_counts[criterion] = top_10_tree_counts[criterion].astype(str)
 
     # Création du bar chart
     fig = px.bar(top_10_tree_counts,
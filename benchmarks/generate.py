@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Racine du dépôt, pour importer les modules de l'application
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import preprocess
+
+# Générateur de jeux de données synthétiques au format de arbres-publics.csv.
+#
+# Les colonnes sont celles du fichier de la Ville et les distributions imitent les vraies données :
+# les 14 arrondissements du mapping (pondérés par leur aire, positions dans leur rectangle du geojson),
+# quelques espèces très fréquentes puis une longue traîne, des plantations surtout récentes avec des
+# dates au 1er janvier, un DHP qui croît avec l'âge de l'arbre, et une part de données aberrantes
+# (coordonnées hors de la ville, dates invalides, DHP manquant ou trop grand) que removeOutliers enlève.
+
+# Tailles générées par défaut
+SIZES = [100_000, 350_000, 1_000_000, 5_000_000]
+
+# Dossier des fichiers générés
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Nombre de lignes générées à la fois
+CHUNK_SIZE = 500_000
+
+# Espèces les plus fréquentes, suivies d'une longue traîne
+COMMON_SPECIES = ['Érable argenté', 'Érable de Norvège', 'Frêne de Pennsylvanie', 'Févier Skyline',
+                  'Tilleul à petites feuilles', 'Micocoulier occidental', 'Orme de Sibérie', 'Érable rouge',
+                  'Érable à sucre', 'Chêne rouge', 'Ginkgo', 'Amélanchier du Canada', 'Lilas japonais',
+                  'Pommetier', 'Orme d\'Amérique', 'Peuplier deltoïde', 'Épinette du Colorado', 'Pin noir']
+NB_SPECIES = 320
+
+STREETS = ['rue Saint-Denis', 'boulevard Saint-Laurent', 'avenue  du Parc', 'rue Sherbrooke', 'rue   Ontario',
+           'avenue Papineau', 'boulevard Rosemont', 'rue Wellington', 'avenue Christophe-Colomb']
+NB_STREETS = 4000
+
+EMPLACEMENTS = ['Trottoir', 'Parterre Gazonné', 'Fond de trottoir', 'Banquette gazonnée', 'Parc', 'Terre-plein']
+
+# Part des lignes aberrantes
+OUTLIER_RATE = 0.02
+
+
+def _boroughs(montreal_data):
+    # Rectangle et aire de chaque arrondissement du mapping, d'après le geojson
+    features = {feature['properties']['NOM']: feature for feature in montreal_data['features']}
+    boroughs = []
+    for code, (name, geojson_name) in enumerate(preprocess.mapping.items()):
+        feature = features[geojson_name]
+        points = np.array([point for polygon in feature['geometry']['coordinates'] for point in polygon[0]])
+        boroughs.append({'ARROND': code + 1, 'ARROND_NOM': name, 'AIRE': feature['properties']['AIRE'],
+                         'bounds': (*points.min(axis=0), *points.max(axis=0))})
+
+    return boroughs
+
+
+def _species():
+    # Espèces avec une fréquence en loi de Zipf et une croissance annuelle du DHP propre à chacune
+    names = COMMON_SPECIES + [f'Espèce {i}' for i in range(len(COMMON_SPECIES), NB_SPECIES)]
+    weights = 1 / np.arange(1, NB_SPECIES + 1)**1.2
+    growth = np.random.default_rng(1).uniform(0.3, 1.2, NB_SPECIES)
+
+    return np.array(names), weights / weights.sum(), growth
+
+
+def _format_dates(dates):
+    # Dates au format du csv ('' pour une date manquante)
+    return np.where(pd.isna(dates), '', pd.DatetimeIndex(dates).strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def generate(n, boroughs, seed=0, start=0):
+    rng = np.random.default_rng(seed)
+    species_names, species_weights, species_growth = _species()
+    streets = np.array(STREETS + [f'rue {i}' for i in range(len(STREETS), NB_STREETS)])
+    latin_names = np.array([f'Species {i}' for i in range(NB_SPECIES)])
+
+    # Arrondissements pondérés par leur aire, positions dans le rectangle de l'arrondissement
+    areas = np.array([borough['AIRE'] for borough in boroughs])
+    borough_codes = rng.choice(len(boroughs), size=n, p=areas / areas.sum())
+    bounds = np.array([borough['bounds'] for borough in boroughs])[borough_codes]
+    longitude = rng.uniform(bounds[:, 0], bounds[:, 2])
+    latitude = rng.uniform(bounds[:, 1], bounds[:, 3])
+
+    # Plantations surtout récentes, dont 10 % au 1er janvier (date seule connue), relevé après la plantation
+    species = rng.choice(len(species_names), size=n, p=species_weights)
+    age_days = np.minimum(rng.exponential(9000, n), 60 * 365).astype(np.int64)
+    plantation = np.datetime64('2023-12-31', 'D') - age_days
+    january = rng.random(n) < 0.10
+    plantation = np.where(january, plantation.astype('datetime64[Y]').astype('datetime64[D]'), plantation)
+    releve = plantation + rng.integers(0, np.maximum(age_days, 1) + 1)
+
+    # DHP selon l'âge et l'espèce
+    dhp = np.round(species_growth[species] * age_days / 365 + rng.gamma(2, 2, n) + 1)
+
+    df = pd.DataFrame({
+        'INV_TYPE': np.where(rng.random(n) < 0.9, 'R', 'H'),
+        'EMP_NO': np.arange(start, start + n) + 1,
+        'ARROND': np.array([borough['ARROND'] for borough in boroughs])[borough_codes],
+        'ARROND_NOM': np.array([borough['ARROND_NOM'] for borough in boroughs])[borough_codes],
+        'Rue': streets[(rng.zipf(1.3, n) - 1) % NB_STREETS],
+        'COTE': rng.choice(['N', 'S', 'E', 'O'], n),
+        'No_civique': rng.integers(1, 12000, n),
+        'Emplacement': rng.choice(EMPLACEMENTS, n, p=[0.4, 0.25, 0.15, 0.1, 0.07, 0.03]),
+        'Coord_X': 304800 + (longitude + 73.5) * 78030,
+        'Coord_Y': 5039800 + (latitude - 45.5) * 111200,
+        'SIGLE': 'SP',
+        'Essence_latin': latin_names[species],
+        'Essence_fr': species_names[species],
+        'ESSENCE_ANG': latin_names[species],
+        'DHP': dhp,
+        'Date_releve': _format_dates(releve),
+        'Date_plantation': _format_dates(plantation),
+        'LOCALISATION': '',
+        'CODE_PARC': '',
+        'NOM_PARC': '',
+        'Longitude': longitude,
+        'Latitude': latitude,
+    })
+
+    # Données aberrantes, réparties entre les cas filtrés par removeOutliers
+    outliers = np.flatnonzero(rng.random(n) < OUTLIER_RATE)
+    kinds = rng.integers(0, 6, len(outliers))
+    df.loc[outliers[kinds == 0], ['Coord_X', 'Longitude']] = [0, 0]
+    df.loc[outliers[kinds == 1], 'DHP'] = np.nan
+    df.loc[outliers[kinds == 2], 'DHP'] = rng.integers(300, 999, (kinds == 2).sum())
+    df.loc[outliers[kinds == 3], 'Date_plantation'] = ''
+    df.loc[outliers[kinds == 4], 'Date_plantation'] = '1700-01-01 00:00:00'
+    df.loc[outliers[kinds == 5], 'Essence_fr'] = np.nan
+
+    return df
+
+
+def write_csv(n, path, seed=0):
+    # Écrit le fichier par blocs de CHUNK_SIZE lignes pour borner la mémoire
+    with open(os.path.join(ROOT, 'assets', 'montreal.json'), encoding='utf-8') as data_file:
+        boroughs = _boroughs(json.load(data_file))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    for chunk, start in enumerate(range(0, n, CHUNK_SIZE)):
+        df = generate(min(CHUNK_SIZE, n - start), boroughs, seed=seed + chunk, start=start)
+        df.to_csv(path, mode='w' if chunk == 0 else 'a', header=chunk == 0, index=False)
+
+
+def get_path(n):
+    return os.path.join(DATA_DIR, f'arbres-{n}.csv')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Génère des fichiers synthétiques au format de arbres-publics.csv')
+    parser.add_argument('sizes', nargs='*', type=int, default=SIZES, help='nombres de lignes (défaut : %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        write_csv(n, get_path(n), seed=args.seed)
+        print(f'{get_path(n)} : {os.path.getsize(get_path(n)) / 1024**2:.1f} Mo')
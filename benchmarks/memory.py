@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+# Racine du dépôt, pour importer les modules de l'application
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import preprocess
+
+# Rapport de la mémoire utilisée par chaque colonne du DataFrame nettoyé, sans et avec le mode compact.
+
+
+def memory_report(before, after):
+    # Octets par colonne avant et après le mode compact
+    report = pd.DataFrame({'Avant': before.memory_usage(index=False, deep=True),
+                           'Après': after.memory_usage(index=False, deep=True)})
+    report = report.reindex(before.columns.union(after.columns, sort=False))
+    report.loc['Total'] = report.sum()
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mémoire utilisée par colonne, sans et avec le mode compact')
+    parser.add_argument('csv', nargs='?', default=os.path.join(ROOT, 'assets', 'arbres-publics.csv'),
+                        help='fichier des arbres (défaut : %(default)s)')
+    args = parser.parse_args()
+
+    raw = pd.read_csv(args.csv, dtype=preprocess.CSV_DTYPES)
+    before = preprocess.preprocess_df(preprocess.removeOutliers(raw))
+    after = preprocess.preprocess_df(preprocess.removeOutliers(raw, compact=True), compact=True)
+    print(memory_report(before, after).to_string())
@@ -0,0 +1,202 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# Racine du dépôt, pour importer les modules de l'application
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import arrond_map
+import bar_chart
+import choropleth
+import count_cube
+import generate
+import geometry
+import growth_stats
+import preprocess
+import rankings
+import selection
+import spatial
+import swarmplot
+import tree_index
+
+warnings.filterwarnings("ignore", category=RuntimeWarning)
+
+# Suite de mesures des fonctions de prétraitement et des figures sur un jeu synthétique.
+#
+# Chaque étape est chronométrée sur plusieurs répétitions (meilleur temps et médiane), puis exécutée
+# une fois sous tracemalloc pour son pic de mémoire (allocations Python et NumPy). Pour les figures,
+# on mesure aussi la taille du JSON envoyé au navigateur. Les résultats sont écrits en JSON avec le
+# commit courant, pour comparer deux commits avec --compare.
+
+# Dossier des résultats
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Arrondissement utilisé pour les figures d'un arrondissement
+ARRONDISSEMENT = 'Le Plateau-Mont-Royal'
+
+# Écart relatif du meilleur temps à partir duquel une étape est signalée par --compare
+THRESHOLD = 0.2
+
+
+def measure(function, repeat):
+    # Temps (meilleur et médian), pic de mémoire et taille du JSON de la figure retournée
+    # Les sélections gardées en cache sont vidées avant chaque exécution, pour mesurer leur calcul
+    times = []
+    for _ in range(repeat):
+        selection.clear()
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    selection.clear()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    measures = {'seconds': min(times), 'median_seconds': statistics.median(times), 'peak_mb': peak / 1024**2}
+    figure = result[0] if isinstance(result, tuple) else result
+    if isinstance(figure, go.Figure):
+        measures['json_kb'] = len(figure.to_json()) / 1024
+
+    return result, measures
+
+
+def run(path, repeat=3):
+    results = {}
+
+    def step(name, function, times=repeat):
+        result, results[name] = measure(function, times)
+        print(f"{name:<32} {results[name]['seconds'] * 1000:10.1f} ms {results[name]['peak_mb']:8.1f} Mo"
+              + (f" {results[name]['json_kb']:8.1f} Ko" if 'json_kb' in results[name] else ''))
+        return result
+
+    # Prétraitement
+    raw = step('read_csv', lambda: pd.read_csv(path, dtype=preprocess.CSV_DTYPES), 1)
+    clean = step('removeOutliers', lambda: preprocess.removeOutliers(raw, compact=True))
+    data = step('preprocess_df', lambda: preprocess.preprocess_df(clean.copy(), compact=True))
+    full = step('preprocess_df (complet)', lambda: preprocess.preprocess_df(preprocess.removeOutliers(raw)), 1)
+    step('read_clean_csv', lambda: preprocess.read_clean_csv(path, compact=True), 1)
+    del raw, clean, full
+
+    with open(os.path.join(ROOT, 'assets', 'montreal.json'), encoding='utf-8') as data_file:
+        montreal_data = json.load(data_file)
+    districts = preprocess.get_districts(montreal_data)
+    montreal_geometry = step('geometry.simplify', lambda: geometry.simplify(montreal_data, geometry.DEFAULT_TOLERANCE))
+
+    # Structures construites au chargement
+    cube = step('build_count_cube', lambda: count_cube.build_count_cube(data))
+    index = step('build_tree_index', lambda: tree_index.build_tree_index(data))
+    grid = step('build_grid', lambda: spatial.build_grid(data))
+    spatial_index = step('build_spatial_index', lambda: spatial.build_spatial_index(data))
+    ranking = step('build_rankings', lambda: rankings.build_rankings(data, index))
+
+    # Carte choroplèthe, avec un filtre de dates et une espèce
+    date_min, date_max = pd.Timestamp('1990-01-01'), pd.Timestamp('2011-01-01')
+    specie = data['Essence_fr'].value_counts().index[0]
+    step('get_nb_trees_district (scan)', lambda: preprocess.get_nb_trees_district(data, date_min, date_max, 0, 300, specie))
+    counts = step('get_nb_trees_district (cube)', lambda: count_cube.get_nb_trees_district(cube, data, date_min, date_max, 0, 300, specie))
+    density = step('add_density', lambda: preprocess.add_density(counts, districts))
+    missing = preprocess.get_missing_districts(counts, districts)
+    step('get_choropleth', lambda: choropleth.get_choropleth(density, missing, montreal_geometry, densite=True))
+    years = np.arange(1990, 2011)
+    cumulative = step('get_cumulative_counts', lambda: count_cube.get_cumulative_counts(cube, data, years, 0, 300, specie))
+    names = cube['districts']['ARROND_NOM'].astype(str).to_numpy()
+    areas = districts.set_index('NOM')['AIRE'].reindex(names).to_numpy()
+    step('get_choropleth_timeline', lambda: choropleth.get_choropleth_timeline(names, areas, cumulative, years, missing, montreal_geometry, densite=True))
+
+    # Cartes des arbres, bar charts et swarmplot
+    filter = (None, date_min, date_max, 0, 300)
+    lod = spatial.get_lod(spatial.DEFAULT_ZOOM)
+    step('getMap (scan)', lambda: arrond_map.getMap(data, ARRONDISSEMENT, 'DHP', filter))
+    step('getMap (index)', lambda: arrond_map.getMap(data, ARRONDISSEMENT, 'DHP', filter, index, grid, lod))
+    step('getMap (ville)', lambda: arrond_map.getMap(data, arrond_map.CITY, 'DHP', filter, index, grid,
+                                                     spatial.get_lod(spatial.CITY_ZOOM), spatial_index))
+    step('draw_bar_chart (ville)', lambda: bar_chart.draw_bar_chart(data, None, 'Rue'))
+    step('draw_bar_chart (arrondissement)', lambda: bar_chart.draw_bar_chart(data, ARRONDISSEMENT, 'Rue', index))
+    step('get_top_k (ville)', lambda: rankings.get_top_k(ranking, index, None, 'Rue'))
+    step('get_top_k (ville, filtre)', lambda: rankings.get_top_k(ranking, index, None, 'Rue', filter))
+    step('get_top_k (arrondissement, filtre)', lambda: rankings.get_top_k(ranking, index, ARRONDISSEMENT, 'Rue', filter))
+    step('growth_stats (1 processus)', lambda: growth_stats.compute(data, workers=1), 1)
+    step(f'growth_stats ({growth_stats.WORKERS} processus)', lambda: growth_stats.compute(data), 1)
+    step('swarm', lambda: swarmplot.swarm(data), 1)
+
+    return len(data), results
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold=THRESHOLD):
+    # Affiche les écarts entre deux fichiers de résultats et retourne les étapes plus lentes
+    regressions = []
+    print(f"{'étape':<32} {'avant':>10} {'après':>10} {'écart':>8}")
+    for name, measures in new['results'].items():
+        if name not in old['results']:
+            continue
+        before, after = old['results'][name]['seconds'], measures['seconds']
+        ratio = after / before if before else np.inf
+        flag = ' !' if ratio > 1 + threshold else ''
+        if flag:
+            regressions.append(name)
+        print(f"{name:<32} {before * 1000:8.1f}ms {after * 1000:8.1f}ms {ratio:7.2f}x{flag}")
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mesure les fonctions de prétraitement et les figures')
+    parser.add_argument('sizes', nargs='*', type=int, default=[100_000], help='nombres de lignes (défaut : %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='répétitions par étape (défaut : %(default)s)')
+    parser.add_argument('--compare', metavar='RÉSULTATS', help='fichier de résultats JSON à comparer (même taille)')
+    args = parser.parse_args()
+
+    exit_code = 0
+    for n in args.sizes:
+        path = generate.get_path(n)
+        if not os.path.exists(path):
+            generate.write_csv(n, path)
+        print(f'--- {n} lignes ({path})')
+        rows, results = run(path, args.repeat)
+
+        output = {
+            'commit': get_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'rows': n,
+            'clean_rows': rows,
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'results': results,
+        }
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output_path = os.path.join(RESULTS_DIR, f"{n}-{output['commit'] or 'local'}.json")
+        with open(output_path, 'w', encoding='utf-8') as output_file:
+            json.dump(output, output_file, indent=2)
+        print(f'Résultats : {output_path}')
+
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as compare_file:
+                if compare(json.load(compare_file), output):
+                    exit_code = 1
+
+    sys.exit(exit_code)
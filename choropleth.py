@@ -1,4 +1,8 @@
+import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
+
+import geometry
 
 def choropleth_hovertemplate() : 
     hover_template = "<b>%{customdata[0]}</b><br>" + \
@@ -20,14 +24,18 @@ def get_choropleth(data_arrondissement, missing_data, montreal_data, densite=Fal
         color = 'Nombre_Arbres'
         title="Nombre d'arbres"
 
+    # Chaque trace ne reçoit que les contours de ses arrondissements : la géométrie n'est envoyée qu'une fois
+    data_geometry = geometry.select(montreal_data, data_arrondissement['ARROND_NOM'])
+    missing_geometry = geometry.select(montreal_data, missing_data['ARROND_NOM'])
+
     # On affiche les arrondissements où il y a des données
-    fig = px.choropleth_mapbox(data_arrondissement, geojson=montreal_data, color=color,
+    fig = px.choropleth_mapbox(data_arrondissement, geojson=data_geometry, color=color,
                             locations="ARROND_NOM", featureidkey="properties.NOM", color_continuous_scale=px.colors.sequential.Greens,
                             center={"lat": 45.545260, "lon": -73.727014},
                             mapbox_style="carto-positron", zoom=8.9, hover_data=["ARROND_NOM", "Nombre_Arbres", "Densite"])
 
     # On affiche les arrondissements où il n'y a aucune donnée
-    missing_areas = px.choropleth_mapbox(missing_data, geojson=montreal_data, color="Nombre_Arbres",color_discrete_sequence =['#CDD1C4'],
+    missing_areas = px.choropleth_mapbox(missing_data, geojson=missing_geometry, color="Nombre_Arbres",color_discrete_sequence =['#CDD1C4'],
                                         locations="ARROND_NOM", featureidkey="properties.NOM",
                                         center={"lat": 45.569260, "lon": -73.707014}, hover_data=["ARROND_NOM", "Nombre_Arbres", "Densite"])
 
@@ -58,3 +66,56 @@ def get_choropleth(data_arrondissement, missing_data, montreal_data, densite=Fal
     )
     
     return fig
+
+
+def get_choropleth_timeline(district_names, areas, counts, years, missing_data, montreal_data, densite=False) :
+    # Animation de la carte choroplèthe année par année : counts contient le nombre cumulé d'arbres de chaque
+    # arrondissement (lignes) plantés depuis la première année de years jusqu'à chaque année (colonnes). Une seule trace porte la géométrie ; les
+    # frames ne changent que les couleurs et les hovers.
+    densities = np.round(counts / np.asarray(areas, dtype=float)[:, None])
+    values = densities if densite else counts
+    title = "Nombre d'arbres <br> par km<sup>2</sup>" if densite else "Nombre d'arbres"
+
+    def get_customdata(column) :
+        return np.column_stack([np.asarray(district_names, dtype=object), counts[:, column], densities[:, column]])
+
+    data_geometry = geometry.select(montreal_data, district_names)
+    fig = go.Figure(go.Choroplethmapbox(geojson=data_geometry, locations=district_names, featureidkey="properties.NOM",
+                                        z=values[:, -1], customdata=get_customdata(-1), coloraxis="coloraxis",
+                                        hovertemplate=choropleth_hovertemplate(), marker_line_width=0.5))
+
+    # Arrondissements sans données, fixes pendant toute l'animation
+    if len(missing_data) :
+        missing_geometry = geometry.select(montreal_data, missing_data['ARROND_NOM'])
+        fig.add_trace(go.Choroplethmapbox(geojson=missing_geometry, locations=missing_data['ARROND_NOM'], featureidkey="properties.NOM",
+                                          z=np.zeros(len(missing_data)), colorscale=[[0, '#CDD1C4'], [1, '#CDD1C4']], showscale=False,
+                                          customdata=missing_data[['ARROND_NOM']].to_numpy(), name="Pas de données", showlegend=True,
+                                          hovertemplate=choropleth_hovertemplate_no_data(), marker_line_width=0.5))
+
+    # Une frame par année, qui ne modifie que la première trace
+    fig.frames = [go.Frame(name=str(year), traces=[0], data=[go.Choroplethmapbox(z=values[:, column], customdata=get_customdata(column))])
+                  for column, year in enumerate(years)]
+
+    # Boutons lecture / pause et curseur des années
+    animation = dict(frame=dict(duration=300, redraw=True), transition=dict(duration=0), mode='immediate')
+    fig.update_layout(
+        updatemenus=[dict(type='buttons', direction='left', x=0.02, y=0.02, xanchor='left', yanchor='bottom', showactive=False,
+                          buttons=[dict(label='▶', method='animate', args=[None, dict(animation, fromcurrent=True)]),
+                                   dict(label='❚❚', method='animate', args=[[None], dict(animation, frame=dict(duration=0, redraw=False))])])],
+        sliders=[dict(active=len(years) - 1, x=0.12, y=0.02, len=0.85, yanchor='bottom', currentvalue=dict(prefix=f'Plantés de {years[0]} à '),
+                      steps=[dict(label=str(year), method='animate', args=[[str(year)], dict(animation, frame=dict(duration=0, redraw=True))])
+                             for year in years])],
+    )
+
+    # Mise en page du graphique, avec une échelle de couleur fixe pour comparer les années
+    fig.update_layout(
+        title="<b>Évolution de la Ville de Montréal</b>",
+        title_x=0.5,
+        mapbox=dict(style="carto-positron", zoom=8.9, center={"lat": 45.545260, "lon": -73.727014}),
+        coloraxis=dict(colorscale=px.colors.sequential.Greens, cmin=0, cmax=max(float(np.nanmax(values)) if values.size else 0, 1),
+                       colorbar=dict(title=title, thickness=23, y=0.60)),
+        legend=dict(y=0, itemclick=False),
+        margin=dict(l=60, r=60, t=60, b=60),
+    )
+
+    return fig
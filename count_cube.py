@@ -0,0 +1,222 @@
+import numpy as np
+import pandas as pd
+
+import metrics
+import preprocess
+
+# Cube de comptage des arbres par arrondissement x espèce x année de plantation x DHP.
+#
+# Les filtres de la carte choroplèthe sont de la forme Date_plantation >= 1er janvier de l'année a
+# et Date_plantation <= 1er janvier de l'année b + 1, DHP >= d1 et DHP <= d2 avec d1, d2 entiers.
+# Pour que le résultat soit exactement celui de preprocess.get_nb_trees_district, chaque unité
+# (année ou cm) est coupée en deux cases : la borne exacte (1er janvier à minuit, DHP entier)
+# et l'intérieur de l'intervalle. Une borne de requête tombe alors toujours entre deux cases.
+#
+# Pour chaque espèce (et pour toutes les espèces confondues), on ne garde que les cases présentes
+# dans les données et on stocke les sommes cumulées 2D sur les axes année et DHP.
+# Une requête coûte alors 4 lectures par arrondissement.
+# Pour les espèces rares, le cube serait plus gros que la liste de leurs arbres : on garde alors
+# seulement les cases de chaque arbre, qu'on filtre directement à la requête.
+# Lors d'un rechargement, les sommes des espèces dont aucun arbre n'a changé sont reprises du cube précédent.
+# Les requêtes comptent dans la mesure 'rows' (metrics) les cases du cube lues, ou les arbres retenus
+# quand elles parcourent les données.
+
+# Nombre maximal de cases du cube par arbre avant de passer à la liste des arbres
+MAX_CELLS_PER_TREE = 4
+
+
+def _date_slots(dates, year0):
+    # Case de date : 2 * année pour le 1er janvier à minuit, 2 * année + 1 sinon
+    is_boundary = (dates.dt.month == 1) & (dates.dt.day == 1) & (dates == dates.dt.normalize())
+    return 2 * (dates.dt.year.to_numpy(dtype=np.int64) - year0) + (~is_boundary).to_numpy(dtype=np.int64)
+
+
+def _dhp_slots(dhp, dhp0):
+    # Case de DHP : 2 * cm pour une valeur entière, 2 * cm + 1 sinon
+    values = dhp.to_numpy(dtype=np.float64)
+    floor = np.floor(values)
+    return 2 * (floor.astype(np.int64) - dhp0) + (values != floor).astype(np.int64)
+
+
+def _prefix_sums(groups, date_slots, dhp_slots):
+    # Sommes cumulées 2D (avec une ligne et une colonne de zéros) sur les cases présentes
+    group_values, group_index = np.unique(groups, return_inverse=True)
+    date_values, date_index = np.unique(date_slots, return_inverse=True)
+    dhp_values, dhp_index = np.unique(dhp_slots, return_inverse=True)
+
+    shape = (len(group_values), len(date_values), len(dhp_values))
+    if np.prod(shape) > MAX_CELLS_PER_TREE * len(groups):
+        return {'groups': groups.astype(np.int16), 'dates': date_slots.astype(np.int16),
+                'dhp': dhp_slots.astype(np.int16), 'prefix': None}
+    flat = np.ravel_multi_index((group_index, date_index, dhp_index), shape)
+    counts = np.bincount(flat, minlength=np.prod(shape)).reshape(shape)
+
+    prefix = np.zeros((shape[0], shape[1] + 1, shape[2] + 1), dtype=np.int32)
+    prefix[:, 1:, 1:] = counts.cumsum(axis=1).cumsum(axis=2)
+
+    return {'groups': group_values, 'dates': date_values, 'dhp': dhp_values, 'prefix': prefix}
+
+
+def build_count_cube(df, previous=None, changed_species=None):
+    # Les arbres sans arrondissement sont ignorés, comme dans le groupby de get_nb_trees_district
+    df = df[['ARROND', 'ARROND_NOM', 'Essence_fr', 'Date_plantation', 'DHP']].dropna(subset=['ARROND', 'ARROND_NOM'])
+
+    # Arrondissements dans l'ordre du groupby
+    district_table = df[['ARROND', 'ARROND_NOM']].drop_duplicates().sort_values(['ARROND', 'ARROND_NOM']).reset_index(drop=True)
+    district_codes = pd.MultiIndex.from_frame(district_table).get_indexer(pd.MultiIndex.from_frame(df[['ARROND', 'ARROND_NOM']]))
+
+    year0 = int(df['Date_plantation'].dt.year.min()) if len(df) else 0
+    dhp0 = int(np.floor(df['DHP'].min())) if len(df) else 0
+    date_slots = _date_slots(df['Date_plantation'], year0)
+    dhp_slots = _dhp_slots(df['DHP'], dhp0)
+
+    cube = {
+        'districts': district_table,
+        'year0': year0,
+        'dhp0': dhp0,
+        'date_min': df['Date_plantation'].min(),
+        'date_max': df['Date_plantation'].max(),
+        'dhp_min': df['DHP'].min(),
+        'dhp_max': df['DHP'].max(),
+        'all': _prefix_sums(district_codes, date_slots, dhp_slots),
+        'species': {},
+    }
+
+    # Les sommes du cube précédent ne sont valables que si les cases et les arrondissements sont les mêmes
+    reuse = (previous is not None and changed_species is not None and previous['year0'] == year0
+             and previous['dhp0'] == dhp0 and previous['districts'].equals(district_table))
+
+    # Un cube par espèce, en parcourant les arbres triés par espèce
+    species = df['Essence_fr'].to_numpy()
+    order = np.argsort(species, kind='stable')
+    names, starts = np.unique(species[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    for name, start, end in zip(names, starts, ends):
+        if reuse and name not in changed_species and name in previous['species']:
+            cube['species'][name] = previous['species'][name]
+            continue
+        rows = order[start:end]
+        cube['species'][name] = _prefix_sums(district_codes[rows], date_slots[rows], dhp_slots[rows])
+
+    return cube
+
+
+def _date_bounds(cube, min_plant_date, max_plant_date):
+    # Convertit les bornes de dates en bornes de cases, ou None si elles ne tombent pas sur un 1er janvier
+    def is_year_boundary(date):
+        return date.month == 1 and date.day == 1 and date == date.normalize()
+
+    min_plant_date, max_plant_date = pd.Timestamp(min_plant_date), pd.Timestamp(max_plant_date)
+    if min_plant_date <= cube['date_min']:
+        low = -np.inf
+    elif is_year_boundary(min_plant_date):
+        low = 2 * (min_plant_date.year - cube['year0'])
+    else:
+        return None
+    if max_plant_date >= cube['date_max']:
+        high = np.inf
+    elif is_year_boundary(max_plant_date):
+        high = 2 * (max_plant_date.year - cube['year0'])
+    else:
+        return None
+
+    return low, high
+
+
+def _dhp_bounds(cube, min_dhp, max_dhp):
+    # Convertit les bornes de DHP en bornes de cases, ou None si elles ne sont pas entières
+    if min_dhp <= cube['dhp_min']:
+        low = -np.inf
+    elif float(min_dhp).is_integer():
+        low = 2 * (int(min_dhp) - cube['dhp0'])
+    else:
+        return None
+    if max_dhp >= cube['dhp_max']:
+        high = np.inf
+    elif float(max_dhp).is_integer():
+        high = 2 * (int(max_dhp) - cube['dhp0'])
+    else:
+        return None
+
+    return low, high
+
+
+def get_nb_trees_district(cube, df, min_plant_date, max_plant_date, min_dhp, max_dhp, specie=None):
+    # Même résultat que preprocess.get_nb_trees_district, en O(arrondissements)
+    date_bounds = _date_bounds(cube, min_plant_date, max_plant_date)
+    dhp_bounds = _dhp_bounds(cube, min_dhp, max_dhp)
+
+    # Bornes non alignées sur les cases du cube : on parcourt les données
+    if date_bounds is None or dhp_bounds is None:
+        trees_per_district = preprocess.get_nb_trees_district(df, min_plant_date, max_plant_date, min_dhp, max_dhp, specie)
+        metrics.add('rows', int(trees_per_district['Nombre_Arbres'].sum()))
+        return trees_per_district
+
+    counts = np.zeros(len(cube['districts']), dtype=np.int64)
+    sums = cube['species'].get(specie) if specie else cube['all']
+    if sums is not None and sums['prefix'] is None:
+        selected = ((sums['dates'] >= date_bounds[0]) & (sums['dates'] <= date_bounds[1])
+                    & (sums['dhp'] >= dhp_bounds[0]) & (sums['dhp'] <= dhp_bounds[1]))
+        counts = np.bincount(sums['groups'][selected], minlength=len(counts))
+        metrics.add('rows', len(sums['groups']))
+    elif sums is not None:
+        date_low = np.searchsorted(sums['dates'], date_bounds[0], side='left')
+        date_high = np.searchsorted(sums['dates'], date_bounds[1], side='right')
+        dhp_low = np.searchsorted(sums['dhp'], dhp_bounds[0], side='left')
+        dhp_high = np.searchsorted(sums['dhp'], dhp_bounds[1], side='right')
+        prefix = sums['prefix']
+        counts[sums['groups']] = (prefix[:, date_high, dhp_high] - prefix[:, date_low, dhp_high]
+                                  - prefix[:, date_high, dhp_low] + prefix[:, date_low, dhp_low])
+        metrics.add('rows', 4 * len(sums['groups']))
+
+    # Comme le groupby, on ne garde que les arrondissements ayant au moins un arbre
+    trees_per_district = cube['districts'].copy()
+    trees_per_district['Nombre_Arbres'] = counts
+    trees_per_district = trees_per_district[trees_per_district['Nombre_Arbres'] > 0].reset_index(drop=True)
+
+    return trees_per_district
+
+
+def get_cumulative_counts(cube, df, years, min_dhp, max_dhp, specie=None):
+    # Nombre d'arbres de chaque arrondissement (lignes de cube['districts']) plantés depuis le 1er janvier de la
+    # première année de years jusqu'à la fin de chaque année (colonnes), en une passe : la dernière colonne est
+    # get_nb_trees_district sur toutes les années de years
+    years = np.asarray(years, dtype=np.int64)
+    dhp_bounds = _dhp_bounds(cube, min_dhp, max_dhp)
+    min_plant_date = pd.Timestamp(year=int(years[0]), month=1, day=1) if len(years) else cube['date_min']
+
+    # Bornes de DHP non alignées sur les cases du cube : une requête par année
+    if dhp_bounds is None:
+        counts = np.zeros((len(cube['districts']), len(years)), dtype=np.int64)
+        for column, year in enumerate(years):
+            trees = preprocess.get_nb_trees_district(df, min_plant_date, pd.Timestamp(year=int(year) + 1, month=1, day=1), min_dhp, max_dhp, specie)
+            rows = pd.MultiIndex.from_frame(cube['districts']).get_indexer(pd.MultiIndex.from_frame(trees[['ARROND', 'ARROND_NOM']]))
+            counts[rows, column] = trees['Nombre_Arbres'].to_numpy()
+            metrics.add('rows', int(trees['Nombre_Arbres'].sum()))
+        return counts
+
+    # Cases de date de la borne inférieure (1er janvier de la première année compris) et de la borne
+    # supérieure de chaque année (1er janvier suivant compris)
+    low = 2 * (min_plant_date.year - cube['year0'])
+    highs = 2 * (years + 1 - cube['year0'])
+    counts = np.zeros((len(cube['districts']), len(years)), dtype=np.int64)
+    sums = cube['species'].get(specie) if specie else cube['all']
+    if sums is not None and sums['prefix'] is None:
+        # Arbres d'une espèce rare : première année où chaque arbre est compté, puis somme cumulée
+        selected = ((sums['dates'] >= low) & (sums['dhp'] >= dhp_bounds[0]) & (sums['dhp'] <= dhp_bounds[1]))
+        first = np.searchsorted(highs, sums['dates'][selected], side='left')
+        counted = first < len(years)
+        np.add.at(counts, (sums['groups'][selected][counted].astype(np.int64), first[counted]), 1)
+        counts = counts.cumsum(axis=1)
+        metrics.add('rows', len(sums['groups']))
+    elif sums is not None:
+        date_low = np.searchsorted(sums['dates'], low, side='left')
+        date_high = np.searchsorted(sums['dates'], highs, side='right')
+        dhp_low = np.searchsorted(sums['dhp'], dhp_bounds[0], side='left')
+        dhp_high = np.searchsorted(sums['dhp'], dhp_bounds[1], side='right')
+        prefix = sums['prefix']
+        counts[sums['groups']] = (prefix[:, date_high, dhp_high] - prefix[:, date_high, dhp_low]
+                                  - (prefix[:, date_low, dhp_high] - prefix[:, date_low, dhp_low])[:, None])
+        metrics.add('rows', 2 * len(sums['groups']) * (len(years) + 1))
+
+    return counts
@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+import arrond_map
+import bar_chart
+import choropleth
+import count_cube
+import figure_cache
+import geometry
+import growth_stats
+import preprocess
+import rankings
+import selection
+import spatial
+import swarmplot
+import tree_index
+
+# Jeu de données de l'application, avec ses structures dérivées et ses figures initiales.
+#
+# Tout est construit d'un bloc par build() et rangé dans un dictionnaire. Les callbacks lisent ce
+# dictionnaire une seule fois avec get() : la première lecture attend la fin de la construction.
+# En démarrage rapide, la construction est lancée dans un thread (start_warm_up) pendant que la
+# page est déjà servie avec des figures d'attente.
+#
+# Quand le fichier source change (nouvelle publication de la Ville), refresh() construit le nouveau
+# jeu à côté de l'ancien puis le remplace d'un bloc : les callbacks en cours finissent sur l'ancien.
+# Les arbres modifiés sont repérés par leur numéro (EMP_NO), et les calculs par espèce (cube de
+# comptage, statistiques du swarmplot) ne sont refaits que pour les espèces touchées.
+
+# Fichier contenant les données sur les arbres
+CSV_PATH = 'assets/arbres-publics.csv'
+
+# Fichier geojson pour le choropleth
+GEOJSON_PATH = 'assets/montreal.json'
+
+# Arrondissement sélectionné par défaut
+ARRONDISSEMENT = 'Le Plateau-Mont-Royal'
+
+# Délai entre deux vérifications du fichier source, en secondes (0 : pas de rechargement)
+RELOAD_INTERVAL = float(os.environ.get('DATA_RELOAD_SECONDS', 0))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_current = None
+_watcher_pid = None
+
+
+def get_source(csv_path=CSV_PATH):
+    # Signature du fichier source : un changement déclenche la reconstruction
+    stat = os.stat(csv_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_changes(previous_data, data):
+    # Espèces dont au moins un arbre a été ajouté, retiré ou modifié, d'après le numéro des arbres,
+    # ou None si les deux versions ne peuvent pas être comparées ainsi
+    if (list(previous_data.columns) != list(data.columns) or 'EMP_NO' not in data.columns
+            or not previous_data['EMP_NO'].is_unique or not data['EMP_NO'].is_unique):
+        return None
+
+    def get_trees(df):
+        columns = [column for column in df.columns if column != 'EMP_NO']
+        return pd.DataFrame({'EMP_NO': df['EMP_NO'].to_numpy(),
+                             'hash': pd.util.hash_pandas_object(df[columns], index=False).to_numpy(),
+                             'specie': df['Essence_fr'].astype(str).to_numpy()})
+
+    trees = get_trees(previous_data).merge(get_trees(data), on='EMP_NO', how='outer', suffixes=('_before', '_after'))
+    changed = trees[trees['hash_before'] != trees['hash_after']]
+
+    return {'trees': len(changed),
+            'species': set(changed['specie_before'].dropna()) | set(changed['specie_after'].dropna())}
+
+
+def build(csv_path=CSV_PATH, previous=None):
+    # Fichier geojson, contours simplifiés des arrondissements envoyés avec la carte choroplèthe
+    # et registre des arrondissements
+    with open(GEOJSON_PATH, encoding='utf-8') as data_file:
+        montreal_data = json.load(data_file)
+    montreal_geometry = geometry.simplify(montreal_data, geometry.DEFAULT_TOLERANCE)
+    districts = preprocess.get_districts(montreal_data)
+
+    # Données sur les arbres, sans les outliers et prétraitées en mode compact
+    # (chargées depuis le snapshot en cache s'il est à jour, projetées en mémoire et partagées entre les workers)
+    source = get_source(csv_path)
+    data, version = preprocess.load_data(csv_path, compact=True, memory_map=True)
+
+    # Même contenu que la version courante (fichier seulement recopié) : rien à reconstruire
+    if previous is not None and previous['version'] == version:
+        return dict(previous, source=source)
+    changes = get_changes(previous['data'], data) if previous is not None else None
+    changed_species = changes['species'] if changes is not None else None
+    index = tree_index.build_tree_index(data)
+
+    bundle = {
+        'version': version,
+        'source': source,
+        'changes': changes,
+        'data': data,
+        'montreal_geometry': montreal_geometry,
+        'districts': districts,
+        # Liste des espèces et des arrondissements
+        'species': preprocess.getSpeciesList(data),
+        'arrondissements': sorted(pd.unique(data['ARROND_NOM'])),
+        # Cube de comptage des arbres pour les filtres de la carte choroplèthe
+        'cube': count_cube.build_count_cube(data, previous and previous['cube'], changed_species),
+        # Index des arbres par arrondissement pour la carte et le bar chart de l'arrondissement
+        'index': index,
+        # Top 10 des bar charts pour la ville et chaque arrondissement
+        'rankings': rankings.build_rankings(data, index, filter=selection.get_default_filter()),
+        # Grilles de regroupement des arbres de la carte de l'arrondissement selon le zoom
+        'grid': spatial.build_grid(data),
+        # Index spatial des arbres pour ne retenir que ceux du rectangle visible de la carte
+        'spatial_index': spatial.build_spatial_index(data),
+    }
+    # Statistiques de croissance des espèces du swarmplot, gardées sur le disque pour chaque version et
+    # reprises de la version précédente pour les espèces inchangées
+    bundle['species_stats'] = growth_stats.get_species_stats(data, previous and previous.get('species_stats'), changed_species,
+                                                             version=bundle['version'])
+    bundle['figures'], bundle['especes'] = build_figures(bundle)
+
+    return bundle
+
+
+def build_figures(bundle):
+    # Figures initiales de la page et liste des espèces du swarmplot, avec le filtre des curseurs à leurs
+    # valeurs initiales : les mêmes figures que les callbacks pour cet état
+    data = bundle['data']
+    filter = selection.get_default_filter()
+    _, min_date_plantation, max_date_plantation, min_dhp, max_dhp = filter
+
+    # Carte choroplèthe de la ville
+    nb_arbres_arrondissement = count_cube.get_nb_trees_district(bundle['cube'], data, min_date_plantation, max_date_plantation,
+                                                                min_dhp, max_dhp)
+    missing_arrondissement = preprocess.get_missing_districts(nb_arbres_arrondissement, bundle['districts'])
+    data_arrondissement = preprocess.add_density(nb_arbres_arrondissement, bundle['districts'])
+    choropleth_fig = choropleth.get_choropleth(data_arrondissement, missing_arrondissement, bundle['montreal_geometry'], densite=False)
+
+    # Carte des arbres de l'arrondissement
+    carte_arrond = arrond_map.getMap(data, ARRONDISSEMENT, 'Date_plantation', filter,
+                                     bundle['index'], bundle['grid'], spatial.get_lod(spatial.DEFAULT_ZOOM))
+
+    # Bar charts de la ville et de l'arrondissement
+    bar_chart_ville = bar_chart.draw_bar_chart(data, None, 'Rue', bundle['index'], bundle['rankings'], filter)
+    bar_chart_arrond = bar_chart.draw_bar_chart(data, ARRONDISSEMENT, 'Rue', bundle['index'], bundle['rankings'], filter)
+
+    # Swarmplot des espèces d'arbres
+    swarm_plot, especes, _ = swarmplot.swarm(data, version=bundle['version'], stats=bundle['species_stats'])
+
+    figures = {
+        'choropleth': choropleth_fig,
+        'carte_arrond': carte_arrond,
+        'barChartVille': bar_chart_ville,
+        'barChartArrond': bar_chart_arrond,
+        'swarm_plot': swarm_plot,
+    }
+
+    return figures, especes
+
+
+def get():
+    # Jeu de données courant, construit au premier appel (les appels concurrents attendent la fin de la construction)
+    global _current
+    if _current is None:
+        with _lock:
+            if _current is None:
+                bundle = build()
+                # Les figures en cache sont invalidées par la version du jeu de données
+                figure_cache.set_version(bundle['version'])
+                _current = bundle
+
+    return _current
+
+
+def peek():
+    # Jeu de données courant, ou None s'il n'est pas encore construit
+    return _current
+
+
+def refresh():
+    # Reconstruit le jeu de données si le fichier source a changé et le remplace d'un bloc ;
+    # retourne True si une nouvelle version est en place
+    global _current
+    with _refresh_lock:
+        previous = get()
+        if get_source() == previous['source']:
+            return False
+        bundle = build(previous=previous)
+        # Le jeu est remplacé avant de changer la version du cache : une figure construite avec
+        # l'ancien jeu n'est jamais gardée sous la nouvelle version
+        _current = bundle
+        figure_cache.set_version(bundle['version'])
+        if bundle['version'] != previous['version']:
+            changes = bundle['changes']
+            logger.info('Jeu de données %s chargé (%s)', bundle['version'],
+                        f"{changes['trees']} arbres modifiés, {len(changes['species'])} espèces" if changes else 'reconstruction complète')
+            return True
+
+    return False
+
+
+def start_watcher(interval=RELOAD_INTERVAL):
+    # Vérifie le fichier source toutes les interval secondes, dans un thread par processus
+    # (un thread du master gunicorn ne survit pas au fork des workers)
+    global _watcher_pid
+    if interval <= 0 or _watcher_pid == os.getpid():
+        return None
+    _watcher_pid = os.getpid()
+
+    def watch():
+        # Le fichier doit être stable sur deux vérifications, pour ne pas lire une copie en cours
+        seen = None
+        while True:
+            time.sleep(interval)
+            try:
+                source = get_source()
+                if source == seen:
+                    refresh()
+                seen = source
+            except Exception:
+                logger.exception('Échec du rechargement du jeu de données')
+
+    thread = threading.Thread(target=watch, name='data-watcher', daemon=True)
+    thread.start()
+
+    return thread
+
+
+def start_warm_up():
+    # Construit le jeu de données dans un thread, sans bloquer le chargement de l'application
+    thread = threading.Thread(target=get, name='warm-up', daemon=True)
+    thread.start()
+
+    return thread
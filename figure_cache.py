@@ -0,0 +1,123 @@
+import functools
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import figure_store
+import latest
+import metrics
+
+# Cache LRU des figures des callbacks, indexé par le nom du callback et ses entrées normalisées.
+# Les figures sont gardées sous forme de dictionnaires plotly déjà convertis (un passage par le JSON à la
+# construction) : un succès retourne le dictionnaire tel quel, sans construction ni conversion. Il est partagé
+# entre les requêtes et ne doit pas être modifié. La taille totale du cache est bornée en octets du JSON des
+# figures et le cache est vidé quand la version du jeu de données change. Avant de construire une figure, on cherche aussi sa version
+# pré-rendue sur le disque (figure_store).
+
+# Taille maximale du cache en octets
+MAX_BYTES = int(os.environ.get('FIGURE_CACHE_MB', 64)) * 1024 * 1024
+
+_lock = threading.Lock()
+_figures = OrderedDict()
+_size = 0
+_version = None
+
+# Compteurs exposés à l'opérateur
+stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'stored': 0}
+
+# Fonctions des callbacks décorés, par nom (utilisées pour pré-rendre les figures)
+builders = {}
+
+
+def normalize(value):
+    # Les listes deviennent des tuples et les nombres entiers des int, pour que des entrées égales donnent la même clé
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(v) for v in value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+
+def set_version(version):
+    # Vide le cache si la version du jeu de données a changé
+    global _size, _version
+    with _lock:
+        if version != _version:
+            _figures.clear()
+            _size = 0
+            _version = version
+
+
+def clear():
+    global _size
+    with _lock:
+        _figures.clear()
+        _size = 0
+
+
+def get_figure(name, inputs, build):
+    # Retourne la figure en cache ou la construit avec build()
+    global _size
+    key = (_version, name, normalize(inputs))
+    with _lock:
+        entry = _figures.get(key)
+        if entry is not None:
+            _figures.move_to_end(key)
+            stats['hits'] += 1
+        else:
+            stats['misses'] += 1
+    if entry is not None:
+        metrics.add('cache_hits')
+        metrics.add('bytes', entry[1])
+        return entry[0]
+
+    # Figure pré-rendue pour cette version, sinon construite
+    figure_json = figure_store.read(key[0], name, key[2]) if key[0] is not None else None
+    if figure_json is not None:
+        with _lock:
+            stats['stored'] += 1
+    else:
+        figure = build()
+        latest.check()
+        with metrics.timer('serialize'):
+            figure_json = (figure.to_json() if hasattr(figure, 'to_json') else json.dumps(figure)).encode('utf-8')
+    metrics.add('bytes', len(figure_json))
+    with metrics.timer('serialize'):
+        figure = json.loads(figure_json)
+
+    with _lock:
+        # La version a pu changer pendant la construction : on ne garde pas une figure périmée
+        if key[0] == _version and key not in _figures and len(figure_json) <= MAX_BYTES:
+            _figures[key] = (figure, len(figure_json))
+            _size += len(figure_json)
+            while _size > MAX_BYTES:
+                _, (_, evicted_size) = _figures.popitem(last=False)
+                _size -= evicted_size
+                stats['evictions'] += 1
+
+    return figure
+
+
+def cached(name):
+    # Décorateur de callback : les arguments du callback forment la clé du cache
+    def decorator(callback):
+        builders[name] = callback
+
+        @functools.wraps(callback)
+        def wrapper(*args):
+            return get_figure(name, args, lambda: callback(*args))
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    with _lock:
+        lookups = stats['hits'] + stats['misses']
+        return dict(stats,
+                    entries=len(_figures),
+                    bytes=_size,
+                    max_bytes=MAX_BYTES,
+                    hit_rate=stats['hits'] / lookups if lookups else 0.0,
+                    version=_version)
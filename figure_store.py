@@ -0,0 +1,99 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+import preprocess
+
+# Figures pré-rendues sur le disque pour les états sans filtre des callbacks.
+#
+# Sans filtre, les vues ne prennent qu'un petit nombre d'états : carte des arbres et bar chart de
+# chaque arrondissement pour chaque critère, bar charts de la ville et les deux échelles de la carte
+# choroplèthe. `python figure_store.py` construit toutes ces figures une fois et les écrit en JSON
+# compressé, une par état, dans un dossier propre à la version du jeu de données et du code des
+# figures. Le cache des figures (figure_cache) lit ce dossier avant de construire une figure : même
+# un worker qui vient de démarrer sert alors ces états par une simple lecture de fichier.
+
+# Dossier des figures pré-rendues
+STORE_DIR = os.path.join(preprocess.SNAPSHOT_DIR, 'figures')
+
+# Modules dont dépendent les figures (dataset construit les structures qu'elles lisent, figure_cache
+# produit leur JSON), et variables d'environnement qui les modifient
+MODULES = ['app', 'arrond_map', 'bar_chart', 'choropleth', 'count_cube', 'dataset', 'figure_cache', 'geometry',
+           'preprocess', 'rankings', 'selection', 'spatial', 'tree_index']
+ENVIRONMENT = ['CHOROPLETH_TOLERANCE', 'MAP_POINTS_ZOOM', 'MAP_MAX_MARKERS']
+
+
+def get_code_version(modules=MODULES, environment=ENVIRONMENT):
+    # Hash du code des modules : une figure pré-rendue avec un autre code n'est pas servie
+    digest = hashlib.sha1()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for module in modules:
+        with open(os.path.join(root, f'{module}.py'), 'rb') as source:
+            digest.update(source.read())
+    digest.update(repr([os.environ.get(name) for name in environment]).encode('utf-8'))
+
+    return digest.hexdigest()[:16]
+
+
+CODE_VERSION = get_code_version()
+
+
+def get_path(version, name, inputs, store_dir=STORE_DIR):
+    # Fichier de la figure name pour ces entrées (déjà normalisées par figure_cache)
+    key = hashlib.sha1(json.dumps([name, inputs], ensure_ascii=False).encode('utf-8')).hexdigest()[:20]
+
+    return os.path.join(store_dir, f'{version}-{CODE_VERSION}', f'{name}-{key}.json.gz')
+
+
+def read(version, name, inputs, store_dir=STORE_DIR):
+    # JSON de la figure pré-rendue, ou None
+    try:
+        with gzip.open(get_path(version, name, inputs, store_dir), 'rb') as figure_file:
+            return figure_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def write(version, name, inputs, figure_json, store_dir=STORE_DIR):
+    # Écriture atomique (plusieurs processus peuvent construire le même dossier)
+    path = get_path(version, name, inputs, store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with gzip.open(tmp_path, 'wb', compresslevel=6) as figure_file:
+        figure_file.write(figure_json)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def build(version, states, builders, store_dir=STORE_DIR):
+    # Construit les figures des états (nom, entrées) avec les fonctions des callbacks,
+    # puis supprime les dossiers des versions précédentes
+    import figure_cache
+
+    sizes = []
+    for name, inputs in states:
+        figure = builders[name](*inputs)
+        figure_json = (figure.to_json() if hasattr(figure, 'to_json') else json.dumps(figure)).encode('utf-8')
+        path = write(version, name, figure_cache.normalize(inputs), figure_json, store_dir)
+        sizes.append((name, len(figure_json), os.path.getsize(path)))
+
+    current = f'{version}-{CODE_VERSION}'
+    for directory in os.listdir(store_dir):
+        if directory != current and os.path.isdir(os.path.join(store_dir, directory)):
+            shutil.rmtree(os.path.join(store_dir, directory), ignore_errors=True)
+
+    return sizes
+
+
+if __name__ == '__main__':
+    import app
+    import dataset
+    import figure_cache
+
+    bundle = dataset.get()
+    sizes = build(bundle['version'], app.get_default_states(bundle), figure_cache.builders)
+    print(f"{len(sizes)} figures : {sum(size for _, size, _ in sizes) / 1024**2:.1f} Mo de JSON, "
+          f"{sum(size for _, _, size in sizes) / 1024**2:.1f} Mo compressés")
@@ -0,0 +1,153 @@
+import json
+import os
+
+import numpy as np
+
+# Géométrie simplifiée des arrondissements pour la carte choroplèthe.
+#
+# Le geojson d'origine est à pleine précision et garde toutes ses propriétés, alors que la carte
+# n'a besoin que du contour des arrondissements à l'échelle de la ville et de leur nom.
+# Les contours sont découpés en arcs aux points où les arrondissements voisins se séparent : un arc
+# commun à deux arrondissements est simplifié une seule fois (Douglas-Peucker), ce qui garde les
+# frontières communes identiques, sans trou ni chevauchement. Les coordonnées sont ensuite arrondies.
+
+# Tolérances de simplification disponibles, en mètres
+TOLERANCES = [10, 25, 50]
+
+# Tolérance utilisée par la carte choroplèthe
+DEFAULT_TOLERANCE = int(os.environ.get('CHOROPLETH_TOLERANCE', 25))
+
+# Nombre de décimales gardées pour les coordonnées (environ 1 m)
+PRECISION = 5
+
+# Propriétés gardées dans les features
+PROPERTIES = ['NOM']
+
+# Mètres par degré de latitude
+METERS_PER_DEGREE = 111320
+
+
+def _douglas_peucker(points, tolerance):
+    # Masque des points gardés d'une ligne (les extrémités sont toujours gardées)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, direction = points[first], points[last] - points[first]
+        inner = points[first + 1:last] - start
+        norm = np.hypot(*direction)
+        if norm == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distances = np.abs(direction[0] * inner[:, 1] - direction[1] * inner[:, 0]) / norm
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack.extend([(first, middle), (middle, last)])
+
+    return keep
+
+
+def _rings(geojson):
+    # Anneaux (extérieurs et trous) de chaque polygone, sans le point de fermeture
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        for polygon in polygons:
+            for ring in polygon:
+                yield [tuple(point) for point in ring[:-1]]
+
+
+def simplify(geojson, tolerance):
+    # Copie simplifiée du geojson (tolérance en mètres), avec seulement les propriétés PROPERTIES
+    rings = list(_rings(geojson))
+
+    # Anneaux passant par chaque point
+    owners = {}
+    for ring_id, ring in enumerate(rings):
+        for point in ring:
+            owners.setdefault(point, set()).add(ring_id)
+
+    # Distances en mètres : la longitude est corrigée par la latitude moyenne
+    latitude = np.mean([point[1] for point in owners]) if owners else 0
+    scale = np.array([np.cos(np.radians(latitude)), 1.0]) * METERS_PER_DEGREE
+
+    # Arcs déjà simplifiés, dans un sens canonique pour qu'un arc commun le soit une seule fois
+    arcs = {}
+
+    def simplify_arc(arc):
+        key = tuple(arc)
+        reverse = key[::-1] < key
+        if reverse:
+            key = key[::-1]
+        if key not in arcs:
+            points = np.array(key)
+            arcs[key] = [key[i] for i in np.flatnonzero(_douglas_peucker(points * scale, tolerance))]
+        return arcs[key][::-1] if reverse else arcs[key]
+
+    def simplify_ring(ring):
+        # Les jonctions sont les points où l'ensemble des anneaux voisins change
+        n = len(ring)
+        junctions = [i for i in range(n)
+                     if owners[ring[i]] != owners[ring[i - 1]] or owners[ring[i]] != owners[ring[(i + 1) % n]]]
+        start = junctions[0] if junctions else 0
+        ring = ring[start:] + ring[:start]
+        junctions = sorted((i - start) % n for i in junctions) or [0]
+        junctions.append(n)
+
+        # Simplification arc par arc, la jonction de fin d'un arc étant le début du suivant
+        simplified = []
+        closed = ring + ring[:1]
+        for begin, end in zip(junctions[:-1], junctions[1:]):
+            simplified.extend(simplify_arc(closed[begin:end + 1])[:-1])
+        simplified.append(simplified[0])
+
+        # Coordonnées arrondies, sans points consécutifs identiques
+        rounded = []
+        for point in simplified:
+            point = [round(point[0], PRECISION), round(point[1], PRECISION)]
+            if not rounded or point != rounded[-1]:
+                rounded.append(point)
+
+        # Un anneau trop petit pour la tolérance est gardé tel quel
+        if len(rounded) < 4:
+            rounded = [[round(x, PRECISION), round(y, PRECISION)] for x, y in ring + ring[:1]]
+        return rounded
+
+    features = []
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        coordinates = [[simplify_ring([tuple(point) for point in ring[:-1]]) for ring in polygon] for polygon in polygons]
+        features.append({
+            'type': 'Feature',
+            'properties': {name: feature['properties'].get(name) for name in PROPERTIES},
+            'geometry': {'type': 'MultiPolygon', 'coordinates': coordinates},
+        })
+
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def get_variants(geojson, tolerances=TOLERANCES):
+    # Géométries simplifiées pour chaque tolérance
+    return {tolerance: simplify(geojson, tolerance) for tolerance in tolerances}
+
+
+def select(geojson, names):
+    # Sous-ensemble du geojson limité aux arrondissements nommés
+    names = set(names)
+    return {'type': 'FeatureCollection',
+            'features': [feature for feature in geojson['features'] if feature['properties']['NOM'] in names]}
+
+
+if __name__ == '__main__':
+    with open('assets/montreal.json', encoding='utf-8') as data_file:
+        montreal_data = json.load(data_file)
+    print(f"Original : {len(json.dumps(montreal_data)) / 1024:.1f} Ko")
+    for tolerance, variant in get_variants(montreal_data).items():
+        points = sum(len(ring) for feature in variant['features'] for polygon in feature['geometry']['coordinates'] for ring in polygon)
+        print(f"Tolérance {tolerance} m : {len(json.dumps(variant)) / 1024:.1f} Ko, {points} points")
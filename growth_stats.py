@@ -0,0 +1,161 @@
+import fcntl
+import hashlib
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import figure_store
+import preprocess
+
+# Statistiques de croissance des espèces du swarmplot : vitesse de croissance du tronc, diamètre moyen
+# et intervalle de confiance bootstrap de la vitesse.
+#
+# La vitesse est la pente de la régression linéaire du DHP sur l'âge (comme scipy.stats.linregress),
+# en cm/an. Une espèce dont tous les arbres ont le même âge (un seul arbre, par exemple) prend le rapport
+# des moyennes du DHP et de l'âge. L'intervalle est formé des percentiles de la pente sur BOOTSTRAP
+# rééchantillonnages des arbres de l'espèce : une espèce de trois arbres a un intervalle large, une espèce
+# de 30 000 arbres un intervalle étroit. Il n'est pas défini pour une espèce d'un seul arbre.
+# Les espèces sont réparties par lots entre les processus d'un ProcessPoolExecutor, et les statistiques
+# sont gardées sur le disque pour chaque version du jeu de données.
+# Le calcul peut être lancé depuis un thread d'un worker gunicorn (démarrage rapide, rechargement à chaud) :
+# les processus viennent donc d'un forkserver, pas d'un fork du worker et de ses threads. Le module principal
+# y est réimporté (__mp_main__) : app.py ne charge pas le jeu de données dans ce cas. Un seul processus à la
+# fois calcule les statistiques d'une version (verrou sur le fichier du cache) ; les autres workers attendent
+# puis lisent le cache.
+
+# Nombre de rééchantillonnages et niveau de confiance de l'intervalle
+BOOTSTRAP = int(os.environ.get('GROWTH_BOOTSTRAP', 1000))
+CONFIDENCE = 0.95
+
+# Nombre de processus du calcul (1 : calcul dans le processus courant)
+WORKERS = int(os.environ.get('GROWTH_WORKERS', os.cpu_count() or 1))
+
+# Nombre de tirages (arbres × rééchantillonnages) calculés d'un bloc, pour borner la mémoire
+BLOCK = 2_000_000
+
+# En dessous de ce nombre de tirages, lancer des processus coûte plus que le calcul
+MIN_PARALLEL_DRAWS = 20_000_000
+
+COLUMNS = ['specie', 'growth', 'dhp', 'trees', 'growth_low', 'growth_high']
+
+# Hash du code du calcul : des statistiques en cache calculées avec un autre code ne sont pas reprises
+CODE_VERSION = figure_store.get_code_version(['growth_stats'], [])
+
+
+def get_slopes(age, dhp):
+    # Pentes de la régression du DHP sur l'âge de chaque ligne (un échantillon par ligne), en cm/jour
+    mean_age = age.mean(axis=-1, keepdims=True)
+    mean_dhp = dhp.mean(axis=-1, keepdims=True)
+    sxx = ((age - mean_age)**2).sum(axis=-1)
+    sxy = ((age - mean_age)*(dhp - mean_dhp)).sum(axis=-1)
+    ratio = mean_dhp[..., 0]/mean_age[..., 0]
+
+    return np.where(sxx > 0, sxy/np.where(sxx > 0, sxx, 1), ratio)
+
+
+def bootstrap(age, dhp, seed, n_resamples=BOOTSTRAP, confidence=CONFIDENCE):
+    # Intervalle de confiance (percentiles) de la pente, en cm/jour
+    n = len(age)
+    if n < 2 or n_resamples <= 0:
+        return np.nan, np.nan
+
+    rng = np.random.default_rng(seed)
+    slopes = np.empty(n_resamples)
+    rows = max(1, BLOCK // n)
+    for start in range(0, n_resamples, rows):
+        stop = min(start + rows, n_resamples)
+        sample = rng.integers(0, n, size=(stop - start, n))
+        slopes[start:stop] = get_slopes(age[sample], dhp[sample])
+
+    low, high = np.percentile(slopes, [50*(1 - confidence), 50*(1 + confidence)])
+    return low, high
+
+
+def get_specie_stats(specie, age, dhp, n_resamples=BOOTSTRAP, confidence=CONFIDENCE):
+    # Ligne de statistiques d'une espèce. La graine vient du nom de l'espèce : l'intervalle ne dépend
+    # ni des lots ni des autres espèces
+    seed = zlib.crc32(specie.encode('utf-8'))
+    low, high = bootstrap(age, dhp, seed, n_resamples, confidence)
+
+    return (specie, round(float(get_slopes(age, dhp))*365, 2), float(dhp.mean()), len(age),
+            round(low*365, 2), round(high*365, 2))
+
+
+def _compute(chunk, n_resamples=BOOTSTRAP, confidence=CONFIDENCE):
+    # Lot d'espèces (espèce, âges, DHP) traité par un processus
+    return [get_specie_stats(specie, age, dhp, n_resamples, confidence) for specie, age, dhp in chunk]
+
+
+def get_chunks(species, n_chunks):
+    # Lots de tailles voisines (en nombre d'arbres), les plus grosses espèces réparties en premier
+    chunks = [[] for _ in range(n_chunks)]
+    sizes = np.zeros(n_chunks, dtype=np.int64)
+    for specie in sorted(species, key=lambda item: -len(item[1])):
+        smallest = int(sizes.argmin())
+        chunks[smallest].append(specie)
+        sizes[smallest] += len(specie[1])
+
+    return [chunk for chunk in chunks if chunk]
+
+
+def get_trees(data):
+    # Âge (jours) et DHP des arbres utilisables de chaque espèce, dans l'ordre d'apparition des espèces
+    trees = data[['Essence_fr', 'Date_plantation', 'Date_releve', 'DHP']].dropna()
+    age = (trees['Date_releve'] - trees['Date_plantation']).dt.days.to_numpy()
+    kept = age > 0
+    codes, species = pd.factorize(trees['Essence_fr'].to_numpy()[kept])
+    age, dhp = age[kept].astype(np.float64), trees['DHP'].to_numpy(dtype=np.float64)[kept]
+
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(species) + 1))
+    return [(str(specie), age[order[start:stop]], dhp[order[start:stop]])
+            for specie, start, stop in zip(species, bounds[:-1], bounds[1:])]
+
+
+def compute(data, previous=None, changed=None, workers=WORKERS, n_resamples=BOOTSTRAP, confidence=CONFIDENCE):
+    # Statistiques de toutes les espèces. Celles de previous sont reprises pour les espèces qui ne sont pas dans changed.
+    known = {} if previous is None or changed is None else {row[0]: row for row in previous[COLUMNS].itertuples(index=False, name=None)}
+    species = get_trees(data)
+    todo = [specie for specie in species if specie[0] not in known or specie[0] in changed]
+
+    draws = sum(len(age) for _, age, _ in todo)*n_resamples
+    if workers > 1 and len(todo) > 1 and draws >= MIN_PARALLEL_DRAWS:
+        chunks = get_chunks(todo, 4*workers)
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context) as executor:
+            results = executor.map(_compute, chunks, [n_resamples]*len(chunks), [confidence]*len(chunks))
+            computed = {row[0]: row for rows in results for row in rows}
+    else:
+        computed = {row[0]: row for row in _compute(todo, n_resamples, confidence)}
+
+    return pd.DataFrame([computed.get(specie) or known[specie] for specie, _, _ in species], columns=COLUMNS)
+
+
+def get_species_stats(data, previous=None, changed=None, version=None, cache_dir=preprocess.SNAPSHOT_DIR, workers=WORKERS):
+    # Statistiques des espèces, gardées sur le disque si la version du jeu de données est donnée
+    if version is None:
+        return compute(data, previous, changed, workers)
+
+    key = hashlib.sha1(repr((version, CODE_VERSION, BOOTSTRAP, CONFIDENCE)).encode('utf-8')).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, f'growth-{key}.feather')
+    if os.path.exists(cache_path):
+        return pd.read_feather(cache_path)
+
+    # Le verrou est libéré à la fermeture du fichier, même si le processus qui calcule s'arrête
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(f'{cache_path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(cache_path):
+            return pd.read_feather(cache_path)
+
+        stats = compute(data, previous, changed, workers)
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        stats.to_feather(tmp_path)
+        os.replace(tmp_path, cache_path)
+
+    return stats
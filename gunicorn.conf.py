@@ -0,0 +1,30 @@
+'''
+    Gunicorn configuration: the application is loaded once in the master process
+    and shared by every worker.
+'''
+import gc
+import multiprocessing
+import os
+
+# Table des requêtes des callbacks, créée dans le master pour être partagée par les workers
+import latest
+
+wsgi_app = 'app:server'
+bind = os.environ.get('BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('WORKERS', multiprocessing.cpu_count()))
+
+# Plusieurs threads par worker : une requête plus récente d'un callback peut arrêter celle qui est
+# en cours au lieu d'attendre derrière elle
+threads = int(os.environ.get('THREADS', 4))
+
+# Le jeu de données, les structures dérivées et les figures initiales sont construits
+# une seule fois dans le master, puis partagés par les workers après le fork.
+# En démarrage rapide (FAST_START=1), chaque worker démarre tout de suite et construit
+# le jeu de données dans son propre thread : un thread du master ne survivrait pas au fork.
+preload_app = os.environ.get('FAST_START', '0') != '1'
+
+
+def when_ready(server):
+    # Les objets créés au chargement ne seront plus parcourus par le ramasse-miettes :
+    # les workers ne recopient pas leurs pages en les touchant
+    gc.freeze()
@@ -0,0 +1,90 @@
+import functools
+import hashlib
+import multiprocessing
+import threading
+
+import flask
+
+import metrics
+
+# Planification « le dernier gagne » des callbacks déclenchés en rafale (déplacement des curseurs).
+#
+# Le navigateur numérote les requêtes des callbacks de chaque page (assets/latest.js, appelé par le
+# renderer de Dash avant chaque requête). Pour chaque page et chaque sortie, la table garde le numéro
+# de la dernière requête reçue : une requête déjà dépassée à son arrivée n'est pas calculée, et un
+# calcul dépassé en cours de route s'arrête au prochain point de contrôle (check). Le callback ne
+# retourne alors rien (PreventUpdate) : le navigateur n'attend de toute façon que la dernière réponse.
+# Les numéros viennent du navigateur, car les requêtes peuvent arriver dans le désordre sur les workers.
+# La table est en mémoire partagée, créée au chargement du module dans le master gunicorn
+# (gunicorn.conf.py l'importe) : elle est commune à tous les workers. Deux pages qui tombent sur la
+# même case ne s'annulent jamais : la case garde la clé de la dernière requête, et seule une requête
+# de la même clé peut rendre un calcul périmé.
+
+# Nombre de cases de la table
+SLOTS = 4096
+
+# Table partagée : clé puis numéro de la dernière requête, pour chaque case
+_table = multiprocessing.Array('q', 2 * SLOTS)
+_local = threading.local()
+
+
+class Superseded(Exception):
+    # Calcul dépassé par une requête plus récente
+    pass
+
+
+def _get_key(page, name):
+    # Clé de 64 bits de la page et de la sortie, et sa case dans la table
+    key = int.from_bytes(hashlib.blake2b(f'{page}\0{name}'.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+    return key, key % SLOTS
+
+
+def start(page, name, sequence):
+    # Enregistre une requête et retourne son jeton (case, clé, numéro)
+    key, slot = _get_key(page, name)
+    with _table.get_lock():
+        table = _table.get_obj()
+        if table[2 * slot] != key or table[2 * slot + 1] < sequence:
+            table[2 * slot], table[2 * slot + 1] = key, sequence
+
+    return slot, key, sequence
+
+
+def is_superseded(token):
+    slot, key, sequence = token
+    with _table.get_lock():
+        table = _table.get_obj()
+        return table[2 * slot] == key and table[2 * slot + 1] > sequence
+
+
+def check():
+    # Point de contrôle : arrête le calcul courant s'il a été dépassé
+    token = getattr(_local, 'token', None)
+    if token is not None and is_superseded(token):
+        raise Superseded()
+
+
+def latest_wins(name):
+    # Décorateur de callback : seule la dernière requête d'une page pour la sortie name va au bout
+    def decorator(callback):
+        @functools.wraps(callback)
+        def wrapper(*args):
+            body = flask.request.get_json(silent=True) if flask.has_request_context() else None
+            stamp = body.get('latest') if isinstance(body, dict) else None
+            if not isinstance(stamp, dict) or not isinstance(stamp.get('sequence'), int):
+                return callback(*args)
+
+            outer, _local.token = getattr(_local, 'token', None), start(str(stamp.get('page')), name, stamp['sequence'])
+            try:
+                # Une requête arrivée après une plus récente n'est pas calculée
+                check()
+                return callback(*args)
+            except Superseded:
+                from dash.exceptions import PreventUpdate
+                metrics.add('superseded')
+                raise PreventUpdate
+            finally:
+                _local.token = outer
+        return wrapper
+    return decorator
@@ -0,0 +1,126 @@
+import contextlib
+import functools
+import os
+import threading
+import time
+
+# Mesures de performance des callbacks, exposées au format texte de Prometheus.
+#
+# Chaque appel d'un callback instrumenté ouvre un enregistrement propre au thread de la requête.
+# Les modules y ajoutent le temps de leurs phases (requête sur les données, conversion en JSON) et
+# leurs compteurs (arbres retenus ou cases du cube lues, octets de la figure, succès du cache, calculs dépassés) avec timer() et add().
+# Le temps de construction de la figure est le reste du temps du callback.
+# Sans METRICS=1, instrument() retourne le callback tel quel et timer()/add() ne font rien.
+
+# Mesures activées
+ENABLED = os.environ.get('METRICS', '0') == '1'
+
+# Bornes (en secondes) de l'histogramme de la durée des callbacks
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Phases mesurées
+PHASES = ['query', 'figure', 'serialize']
+
+# Compteurs d'un callback
+COUNTERS = ['rows', 'bytes', 'cache_hits', 'superseded']
+
+_lock = threading.Lock()
+_local = threading.local()
+_callbacks = {}
+_null = contextlib.nullcontext()
+
+
+def _new_record():
+    return {'seconds': 0.0, **{phase: 0.0 for phase in PHASES}, **{counter: 0 for counter in COUNTERS}}
+
+
+@contextlib.contextmanager
+def _timer(record, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record[phase] += time.perf_counter() - start
+
+
+def timer(phase):
+    # Contexte qui ajoute sa durée à la phase de l'enregistrement courant
+    record = getattr(_local, 'record', None) if ENABLED else None
+    if record is None:
+        return _null
+
+    return _timer(record, phase)
+
+
+def add(counter, value=1):
+    # Ajoute value au compteur de l'enregistrement courant
+    record = getattr(_local, 'record', None) if ENABLED else None
+    if record is not None:
+        record[counter] += value
+
+
+def instrument(name):
+    # Décorateur de callback : mesure chaque appel sous le nom name
+    def decorator(callback):
+        if not ENABLED:
+            return callback
+
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            outer, _local.record = getattr(_local, 'record', None), _new_record()
+            start = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                record, _local.record = _local.record, outer
+                record['seconds'] = time.perf_counter() - start
+                record['figure'] = max(record['seconds'] - record['query'] - record['serialize'], 0.0)
+                _observe(name, record)
+        return wrapper
+    return decorator
+
+
+def _observe(name, record):
+    with _lock:
+        totals = _callbacks.setdefault(name, {'calls': 0, 'buckets': [0] * len(BUCKETS), **_new_record()})
+        totals['calls'] += 1
+        for key in ['seconds'] + PHASES + COUNTERS:
+            totals[key] += record[key]
+        for i, bound in enumerate(BUCKETS):
+            if record['seconds'] <= bound:
+                totals['buckets'][i] += 1
+
+
+def render():
+    # Mesures au format texte de Prometheus (version 0.0.4)
+    with _lock:
+        callbacks = {name: dict(totals, buckets=list(totals['buckets'])) for name, totals in sorted(_callbacks.items())}
+
+    lines = []
+
+    def metric(metric_name, kind, help, samples):
+        # samples : (suffixe du nom, étiquettes, valeur)
+        lines.append(f'# HELP {metric_name} {help}')
+        lines.append(f'# TYPE {metric_name} {kind}')
+        for suffix, labels, value in samples:
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f'{metric_name}{suffix}{{{label_text}}} {value}')
+
+    histogram = []
+    for name, totals in callbacks.items():
+        histogram += [('_bucket', {'callback': name, 'le': bound}, count)
+                      for bound, count in zip(BUCKETS + ['+Inf'], totals['buckets'] + [totals['calls']])]
+        histogram += [('_sum', {'callback': name}, totals['seconds']), ('_count', {'callback': name}, totals['calls'])]
+    metric('dash_callback_duration_seconds', 'histogram', 'Durée des callbacks.', histogram)
+    metric('dash_callback_phase_seconds_total', 'counter', 'Temps passé dans chaque phase des callbacks.',
+           [('', {'callback': name, 'phase': phase}, totals[phase]) for name, totals in callbacks.items() for phase in PHASES])
+    metric('dash_callback_rows_total', 'counter', 'Lignes lues par les requêtes des callbacks (arbres retenus, cases du cube de comptage).',
+           [('', {'callback': name}, totals['rows']) for name, totals in callbacks.items()])
+    metric('dash_callback_response_bytes_total', 'counter', 'Taille du JSON des figures retournées.',
+           [('', {'callback': name}, totals['bytes']) for name, totals in callbacks.items()])
+    metric('dash_callback_cache_hits_total', 'counter', 'Figures servies par le cache des figures.',
+           [('', {'callback': name}, totals['cache_hits']) for name, totals in callbacks.items()])
+    metric('dash_callback_superseded_total', 'counter', 'Calculs arrêtés par une requête plus récente de la même session.',
+           [('', {'callback': name}, totals['superseded']) for name, totals in callbacks.items()])
+
+    return '\n'.join(lines) + '\n'
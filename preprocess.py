@@ -1,5 +1,40 @@
+import hashlib
+import inspect
+import os
+
 import pandas as pd
-import geopandas as gpd
+import pyarrow.feather as feather
+from pandas.api.types import union_categoricals
+
+# Dossier des snapshots prétraités du jeu de données
+SNAPSHOT_DIR = 'assets/cache'
+
+# Types explicites des colonnes lues dans le csv
+CSV_DTYPES = {
+    'ARROND': 'float64',
+    'ARROND_NOM': 'str',
+    'Rue': 'str',
+    'Emplacement': 'str',
+    'Essence_fr': 'str',
+    'DHP': 'float64',
+    'Coord_X': 'float64',
+    'Coord_Y': 'float64',
+    'Longitude': 'float64',
+    'Latitude': 'float64',
+    'Date_plantation': 'str',
+    'Date_releve': 'str',
+}
+
+# Colonnes gardées en mode compact (celles lues par les visualisations, et le numéro de l'arbre
+# qui sert à repérer les arbres modifiés entre deux versions du fichier)
+COMPACT_COLUMNS = ['EMP_NO', 'ARROND', 'ARROND_NOM', 'Rue', 'Emplacement', 'Essence_fr', 'DHP',
+                   'Date_plantation', 'Date_releve', 'Longitude', 'Latitude']
+
+# Colonnes de texte stockées en catégories dès la lecture en mode compact
+TEXT_COLUMNS = ['ARROND_NOM', 'Rue', 'Emplacement', 'Essence_fr']
+
+# Nombre de lignes du csv lues à la fois par read_clean_csv
+CHUNK_SIZE = 50_000
 
 # Mapping des noms des arrondissements entre le csv et le geojson
 mapping = {
@@ -20,7 +55,26 @@ mapping = {
 }
 
 
-def preprocess_df(df) : 
+def preprocess_df(df, compact=False) : 
+    if compact:
+        # En mode compact, les dates en string sont calculées seulement pour les hovers
+        # et les colonnes de texte sont stockées en catégories
+        df['EMP_NO'] = pd.to_numeric(df['EMP_NO'], downcast='integer')
+        df['ARROND'] = pd.to_numeric(df['ARROND'], downcast='integer')
+        df['ARROND_NOM'] = df['ARROND_NOM'].astype('category').map(mapping).astype('category')
+        rues = df['Rue'].astype('category').cat.categories
+        df['Rue'] = df['Rue'].astype('category').map(dict(zip(rues, rues.str.replace(r'\s{2,}', ' ', regex=True)))).astype('category')
+        df['Emplacement'] = df['Emplacement'].astype('category')
+        df['Essence_fr'] = df['Essence_fr'].astype('category')
+        # Les catégories renommées sont triées, comme les valeurs du groupby en mode normal
+        for column in ['ARROND_NOM', 'Rue']:
+            df[column] = df[column].cat.reorder_categories(df[column].cat.categories.sort_values())
+        df['DHP'] = pd.to_numeric(df['DHP'], downcast='integer')
+        if df['DHP'].dtype.kind == 'f':
+            df['DHP'] = pd.to_numeric(df['DHP'], downcast='float')
+
+        return df
+
     # Créer une colonne avec les dates en string
     df['Date_plantation_format'] = df['Date_plantation'].dt.strftime('%Y-%m-%d')
     df['Date_releve_format'] = df['Date_releve'].dt.strftime('%Y-%m-%d')
@@ -31,7 +85,7 @@ def preprocess_df(df) :
 
     return df
 
-def removeOutliers(df):
+def removeOutliers(df, compact=False):
     # Enlève les données aberrantes
     clean = df
     clean = clean[(clean['Coord_X'] > 270000) & (clean['Coord_X'] < 310000) & (clean['Coord_Y'] > 5030000) & (clean['Coord_Y'] < 5070000)]
@@ -44,24 +98,57 @@ def removeOutliers(df):
     clean = clean[(clean['Date_releve'].dt.year > 1950) & (clean['Date_releve'].dt.year < 2024) & (clean['Date_plantation'].dt.year <= clean['Date_releve'].dt.year)]
     clean = clean.dropna(subset=['Date_releve'])
     clean = clean[(clean['Longitude'] > -74) & (clean['Longitude'] < -73) & (clean['Latitude'] > 45) & (clean['Latitude'] < 46)]
+    # En mode compact, on ne garde que les colonnes utilisées
+    if compact:
+        clean = clean[COMPACT_COLUMNS].copy()
     
     return clean
 
-def getSpeciesList(df):
-    # Retourne la liste des espèces triées
-    return sorted(pd.unique(df['Essence_fr']))
+def outlier_mask(chunk):
+    # Règles de removeOutliers réunies en un seul masque ; les dates ne sont analysées que pour les lignes
+    # qui respectent déjà les autres règles. Retourne le masque et les dates des lignes gardées.
+    keep = ((chunk['Coord_X'] > 270000) & (chunk['Coord_X'] < 310000) & (chunk['Coord_Y'] > 5030000) & (chunk['Coord_Y'] < 5070000)
+            & chunk[['Essence_fr', 'ARROND_NOM', 'Rue', 'Emplacement', 'DHP']].notna().all(axis=1)
+            & (chunk['DHP'] < 300)
+            & (chunk['Longitude'] > -74) & (chunk['Longitude'] < -73) & (chunk['Latitude'] > 45) & (chunk['Latitude'] < 46)).to_numpy()
+    plantation = pd.to_datetime(chunk['Date_plantation'][keep], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    releve = pd.to_datetime(chunk['Date_releve'][keep], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    valid_dates = ((plantation.dt.year > 1800) & (plantation.dt.year < 2024)
+                   & (releve.dt.year > 1950) & (releve.dt.year < 2024) & (plantation.dt.year <= releve.dt.year))
+    keep[keep] = valid_dates.to_numpy()
 
-def get_neighborhoods(montreal_data):
-    # Retourne la liste des arrondissements du geojson
-    locations = []
-    for feature in montreal_data.get('features', []):
-        properties = feature.get('properties', {})
-        nom = properties.get('NOM', None)
-        if nom:
-            locations.append(nom)
+    return keep, plantation[valid_dates], releve[valid_dates]
 
-    return locations
+def read_clean_csv(csv_path, compact=False, chunksize=CHUNK_SIZE):
+    # Même résultat que removeOutliers(pd.read_csv(csv_path, dtype=CSV_DTYPES), compact), sans charger tout le csv :
+    # le fichier est lu par blocs (seulement les colonnes utiles en mode compact) et on ne garde que les lignes
+    # retenues de chaque bloc, avec les colonnes de texte en catégories en mode compact
+    usecols = COMPACT_COLUMNS + ['Coord_X', 'Coord_Y'] if compact else None
+    dtypes = {column: dtype for column, dtype in CSV_DTYPES.items() if usecols is None or column in usecols}
+    chunks = []
+    for chunk in pd.read_csv(csv_path, usecols=usecols, dtype=dtypes, chunksize=chunksize):
+        keep, plantation, releve = outlier_mask(chunk)
+        chunk = chunk[keep]
+        chunk = chunk.assign(Date_plantation=plantation, Date_releve=releve)
+        if compact:
+            chunk = chunk[COMPACT_COLUMNS].astype({column: 'category' for column in TEXT_COLUMNS})
+        chunks.append(chunk)
+    if not chunks:
+        return removeOutliers(pd.read_csv(csv_path, usecols=usecols, dtype=dtypes), compact)
 
+    # Les blocs reçoivent les mêmes catégories, triées comme celles d'un astype('category') sur tout le fichier,
+    # pour que la concaténation reste en catégories
+    if compact:
+        for column in TEXT_COLUMNS:
+            categories = union_categoricals([chunk[column] for chunk in chunks], sort_categories=True).categories
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    
+    return pd.concat(chunks)
+
+def getSpeciesList(df):
+    # Retourne la liste des espèces triées
+    return sorted(pd.unique(df['Essence_fr']))
 
 def get_nb_trees_district(df, min_plant_date, max_plant_date, min_dhp, max_dhp, specie=None):
     # Filtrer les arbres plantés entre les dates min et max
@@ -75,17 +162,30 @@ def get_nb_trees_district(df, min_plant_date, max_plant_date, min_dhp, max_dhp,
         filtered_df = filtered_df[filtered_df['Essence_fr'] == specie]
 
     # Compter le nombre d'arbres par arrondissement
-    trees_per_district = filtered_df.groupby(['ARROND', 'ARROND_NOM']).size().reset_index(name='Nombre_Arbres')
+    trees_per_district = filtered_df.groupby(['ARROND', 'ARROND_NOM'], observed=True).size().reset_index(name='Nombre_Arbres')
 
     return trees_per_district
 
 
-def get_missing_districts(tree_count_per_district, locations):
-    # Liste des arrondissements présents dans le DataFrame
-    existing_districts = tree_count_per_district['ARROND_NOM'].tolist()
+def get_districts(montreal_data):
+    # Registre des arrondissements du geojson (nom, aire en km² et géométrie), construit une seule fois
+    districts = []
+    for feature in montreal_data.get('features', []):
+        properties = feature.get('properties', {})
+        nom = properties.get('NOM', None)
+        aire = properties.get('AIRE')
+        if nom:
+            # Sans aire, la densité de l'arrondissement n'est pas calculée (NaN)
+            districts.append({'NOM': nom,
+                              'AIRE': aire / 1000000 if aire is not None else float('nan'),
+                              'geometry': feature.get('geometry')})
+
+    return pd.DataFrame(districts, columns=['NOM', 'AIRE', 'geometry'])
+
 
-    # Liste des arrondissements à ajouter
-    districts_to_add = [district for district in locations if district not in existing_districts]
+def get_missing_districts(tree_count_per_district, districts):
+    # Arrondissements du registre absents du DataFrame
+    districts_to_add = districts.loc[~districts['NOM'].isin(tree_count_per_district['ARROND_NOM']), 'NOM'].tolist()
 
     # Créer un DataFrame pour les arrondissements manquants avec NaN pour le nombre d'arbres
     missing_districts_data = pd.DataFrame({'ARROND_NOM': districts_to_add, 'Nombre_Arbres': "Pas de données", 'AIRE': "Pas de données", 'Densite': "Pas de données"})
@@ -93,20 +193,69 @@ def get_missing_districts(tree_count_per_district, locations):
     return missing_districts_data
 
 
-def add_density(df, geojson_path):
-    data = gpd.read_file(geojson_path)
-
-    # Sélectionner uniquement les colonnes 'NOM' et 'AREA'
-    district_areas = data[['NOM', 'AIRE']]
-
-    # Joindre les données des arrondissements avec les données d'aire
-    district_data = pd.merge(df, district_areas, left_on='ARROND_NOM', right_on='NOM', how='left')
+def add_density(df, districts):
+    # Joindre les données des arrondissements avec les aires du registre (déjà en km²)
+    district_data = pd.merge(df, districts[['NOM', 'AIRE']], left_on='ARROND_NOM', right_on='NOM', how='left')
 
     # Supprimer la colonne 'NOM' redondante
     district_data.drop(columns=['NOM'], inplace=True)
     
-    # Convertir l'aire en km² et calculer la densité d'arbres
-    district_data['AIRE'] = district_data['AIRE'] / 1000000
+    # Calculer la densité d'arbres
     district_data['Densite'] = round(district_data['Nombre_Arbres'] / district_data['AIRE'])
 
     return district_data
+
+
+def get_data_version(csv_path, compact=False):
+    # Hash du fichier source et des règles de nettoyage, utilisé comme version du jeu de données
+    digest = hashlib.sha1()
+    with open(csv_path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+    for rule in (removeOutliers, outlier_mask, read_clean_csv, preprocess_df):
+        digest.update(inspect.getsource(rule).encode('utf-8'))
+    digest.update(repr(sorted(mapping.items())).encode('utf-8'))
+    digest.update(repr(sorted(CSV_DTYPES.items())).encode('utf-8'))
+    digest.update(repr(COMPACT_COLUMNS if compact else None).encode('utf-8'))
+
+    return digest.hexdigest()[:16]
+
+
+def read_snapshot(snapshot_path, memory_map=False):
+    # Avec memory_map, les colonnes numériques pointent directement sur le fichier projeté en mémoire (sans copie) :
+    # ces pages sont partagées par tous les processus qui lisent le même snapshot
+    if memory_map:
+        return feather.read_table(snapshot_path, memory_map=True).to_pandas(split_blocks=True)
+
+    return pd.read_feather(snapshot_path)
+
+
+def load_data(csv_path, snapshot_dir=SNAPSHOT_DIR, compact=False, memory_map=False):
+    # Charge directement le snapshot prétraité s'il correspond à la version courante du csv
+    version = get_data_version(csv_path, compact)
+    snapshot_path = os.path.join(snapshot_dir, f'arbres-{version}.feather')
+    if os.path.exists(snapshot_path):
+        return read_snapshot(snapshot_path, memory_map), version
+
+    # Sinon, on refait le prétraitement complet à partir du csv
+    df = read_clean_csv(csv_path, compact)
+    df = preprocess_df(df, compact)
+    df = df.reset_index(drop=True)
+
+    # Écriture atomique du snapshot (plusieurs workers peuvent le construire en même temps),
+    # sans compression et en un seul bloc pour qu'il puisse être projeté en mémoire sans copie
+    os.makedirs(snapshot_dir, exist_ok=True)
+    tmp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+    df.to_feather(tmp_path, compression='uncompressed', chunksize=max(len(df), 1))
+    os.replace(tmp_path, snapshot_path)
+
+    # On supprime les snapshots des versions précédentes
+    for name in os.listdir(snapshot_dir):
+        if name.startswith('arbres-') and name.endswith('.feather') and name != os.path.basename(snapshot_path):
+            os.remove(os.path.join(snapshot_dir, name))
+
+    # On relit le snapshot pour que même le premier processus utilise les colonnes projetées en mémoire
+    if memory_map:
+        df = read_snapshot(snapshot_path, memory_map)
+
+    return df, version
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+import metrics
+import selection
+import tree_index
+
+# Classements (top k) des rues, emplacements et espèces pour les bar charts, construits au chargement.
+#
+# Chaque critère est encodé une fois en codes entiers, dans l'ordre alphabétique des catégories.
+# Le top k de la ville et de chaque arrondissement est calculé d'avance pour le filtre des curseurs à leurs
+# valeurs initiales (selection.get_default_filter) : avec ce filtre, un bar chart n'est qu'une lecture de table. Avec un filtre (espèce, dates, DHP), les arbres retenus viennent de
+# la sélection partagée avec la carte des arbres (selection) et leurs codes sont comptés avec np.bincount, puis le top k est sélectionné par
+# np.argpartition, sans groupby ni tri de toutes les catégories.
+# Comme le tri stable de draw_bar_chart, les égalités sont départagées par l'ordre alphabétique
+# (la catégorie la plus loin dans l'ordre l'emporte).
+
+# Critères des bar charts
+CRITERIA = ['Rue', 'Emplacement', 'Essence_fr']
+
+# Nombre de catégories gardées
+K = 10
+
+
+def top_k(counts, k=K):
+    # Codes des k catégories les plus fréquentes (sans les catégories vides), du plus petit au plus grand compte
+    codes = np.flatnonzero(counts)
+    if len(codes) > k:
+        # Clé unique par catégorie : le compte, puis le code pour départager les égalités
+        keys = counts[codes].astype(np.int64) * len(counts) + codes
+        codes = codes[np.argpartition(keys, len(codes) - k)[len(codes) - k:]]
+    codes = codes[np.lexsort((codes, counts[codes]))]
+
+    return codes, counts[codes]
+
+
+def build_rankings(df, index, k=K, filter=None):
+    # Classements précalculés pour filter (None : tous les arbres)
+    rankings = {
+        'k': k,
+        'filter': filter,
+        'date_min': df['Date_plantation'].min(),
+        'date_max': df['Date_plantation'].max(),
+        'dhp_min': df['DHP'].min(),
+        'dhp_max': df['DHP'].max(),
+        'criteria': {},
+    }
+    # Arbres retenus par le filtre des tables, pour la ville (None : tous) et chaque arrondissement
+    filtered = is_filtered(rankings, filter)
+    city_rows = tree_index.filter_rows(index, np.arange(len(df)), filter) if filtered else None
+    district_rows = {name: tree_index.query(index, name, filter) if filtered else district['rows']
+                     for name, district in index['districts'].items()}
+    for criterion in CRITERIA:
+        # Codes des catégories triées (-1 pour une valeur manquante, ignorée comme dans le groupby)
+        codes, names = pd.factorize(df[criterion], sort=True)
+        names = np.asarray(names).astype(str)
+        n = len(names)
+
+        def get_top(rows=None):
+            selected = codes if rows is None else codes[rows]
+            top, counts = top_k(np.bincount(selected + 1, minlength=n + 1)[1:], k)
+            return names[top], counts
+
+        rankings['criteria'][criterion] = {
+            'codes': codes.astype(np.int32),
+            'names': names,
+            # Top k sans filtre de la ville (clé None) et de chaque arrondissement
+            'top': {None: get_top(city_rows), **{name: get_top(rows) for name, rows in district_rows.items()}},
+        }
+
+    return rankings
+
+
+def is_filtered(rankings, filter):
+    # Vrai si le filtre écarte des arbres (des bornes qui englobent toutes les données ne filtrent rien)
+    if filter is None:
+        return False
+    espece, min_date_plantation, max_date_plantation, min_dhp, max_dhp = filter
+
+    return bool(espece
+                or (min_date_plantation is not None and pd.Timestamp(min_date_plantation) > rankings['date_min'])
+                or (max_date_plantation is not None and pd.Timestamp(max_date_plantation) < rankings['date_max'])
+                or (min_dhp is not None and min_dhp > rankings['dhp_min'])
+                or (max_dhp is not None and max_dhp < rankings['dhp_max']))
+
+
+def is_precomputed(rankings, filter):
+    # Vrai si les tables répondent au filtre : le filtre des tables, ou deux filtres qui ne filtrent rien
+    if filter == rankings['filter']:
+        return True
+
+    return not is_filtered(rankings, filter) and not is_filtered(rankings, rankings['filter'])
+
+
+def get_top_k(rankings, index, arrondissement, criterion, filter=None):
+    # Noms et comptes du top k (arrondissement None : toute la ville), du plus petit au plus grand compte
+    ranking = rankings['criteria'][criterion]
+    filter = filter or (None, None, None, None, None)
+    if is_precomputed(rankings, filter):
+        return ranking['top'].get(arrondissement, (ranking['names'][:0], np.empty(0, dtype=np.int64)))
+
+    # Arbres retenus par le filtre, puis comptage de leurs catégories
+    if arrondissement:
+        codes = ranking['codes'][selection.get_rows(index, arrondissement, filter)]
+    else:
+        codes = ranking['codes'][selection.get_mask(index, filter)]
+    metrics.add('rows', len(codes))
+    top, counts = top_k(np.bincount(codes[codes >= 0], minlength=len(ranking['names'])), rankings['k'])
+
+    return ranking['names'][top], counts
@@ -0,0 +1,83 @@
+import functools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import tree_index
+
+# Sélections d'arbres partagées entre les callbacks des figures.
+#
+# Un déplacement d'un filtre (espèce, dates de plantation, DHP) déclenche en même temps les callbacks
+# de la carte des arbres et des bar charts, avec le même état des filtres. Chaque sélection est donc
+# calculée une seule fois et gardée dans un petit cache LRU : pour la ville, un masque booléen des
+# arbres (un rectangle visible n'en lit que ses arbres) ; pour un arrondissement, les positions des
+# arbres retenues par l'index. Les bornes des curseurs sont aussi converties une seule fois en filtre.
+
+# Nombre de sélections gardées
+MAX_ENTRIES = 8
+
+# Valeurs initiales des curseurs : la page et les classements précalculés (rankings) partent de ce filtre
+DATE_RANGE = [1960, 2023]
+DHP_RANGE = [0, 300]
+
+_lock = threading.Lock()
+_selections = OrderedDict()
+
+
+@functools.lru_cache(maxsize=256)
+def _get_filter(specie, min_year, max_year, min_dhp, max_dhp):
+    return (specie, pd.Timestamp(year=min_year, month=1, day=1), pd.Timestamp(year=max_year + 1, month=1, day=1), min_dhp, max_dhp)
+
+
+def get_filter(specie, date_range, dhp_range):
+    # Filtre (espèce, date min, date max, DHP min, DHP max) des curseurs : la date max est le 1er janvier
+    # qui suit l'année choisie, comme pd.to_datetime(str(année + 1), format='%Y')
+    return _get_filter(specie, int(date_range[0]), int(date_range[1]), dhp_range[0], dhp_range[1])
+
+
+def get_default_filter():
+    # Filtre des curseurs à leurs valeurs initiales, sans espèce
+    return get_filter(None, DATE_RANGE, DHP_RANGE)
+
+
+def _get_selection(index, arrondissement, filter, build):
+    # Sélection en cache pour cet index (donc cette version du jeu de données), ou construite avec build()
+    key = (arrondissement, filter)
+    with _lock:
+        entry = _selections.get(key)
+        if entry is not None and entry[0] is index:
+            _selections.move_to_end(key)
+            return entry[1]
+
+    selection = build()
+    # La sélection est partagée entre les callbacks : elle ne doit pas être modifiée
+    selection.flags.writeable = False
+    with _lock:
+        _selections[key] = (index, selection)
+        _selections.move_to_end(key)
+        while len(_selections) > MAX_ENTRIES:
+            _selections.popitem(last=False)
+
+    return selection
+
+
+def get_mask(index, filter):
+    # Masque booléen des arbres de toute la ville qui respectent le filtre
+    def build():
+        mask = np.zeros(len(index['dates']), dtype=bool)
+        mask[tree_index.filter_rows(index, np.arange(len(mask)), filter)] = True
+        return mask
+
+    return _get_selection(index, None, filter, build)
+
+
+def get_rows(index, arrondissement, filter):
+    # Positions (triées) des arbres de l'arrondissement qui respectent le filtre
+    return _get_selection(index, arrondissement, filter, lambda: tree_index.query(index, arrondissement, filter))
+
+
+def clear():
+    with _lock:
+        _selections.clear()
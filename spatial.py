@@ -0,0 +1,175 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Niveaux de détail de la carte de l'arrondissement.
+#
+# Au chargement, chaque arbre reçoit l'identifiant de sa cellule dans plusieurs grilles régulières
+# (de la plus grossière à la plus fine). Loin de la carte, les arbres retenus par les filtres sont
+# regroupés par cellule : chaque groupe porte le nombre d'arbres et la moyenne du critère affiché.
+# Les arbres ne sont affichés un par un qu'au-delà d'un niveau de zoom, et le nombre de marqueurs
+# envoyés au navigateur ne dépasse jamais MAX_MARKERS.
+#
+# Un index spatial (grille uniforme de seaux, arbres triés par seau) permet aussi de ne retenir
+# que les arbres visibles à l'écran : chaque rangée de seaux du rectangle visible est une tranche
+# contiguë des arbres triés.
+
+# Côté des cellules de la grille, en degrés de latitude
+GRID_SIZES = [0.008, 0.004, 0.002, 0.001]
+
+# Taille visée d'une cellule à l'écran, en pixels
+CELL_PIXELS = 30
+
+# Zoom à partir duquel les arbres sont affichés individuellement
+POINTS_ZOOM = float(os.environ.get('MAP_POINTS_ZOOM', 15))
+
+# Nombre maximal de marqueurs (arbres ou groupes) dans la figure
+MAX_MARKERS = int(os.environ.get('MAP_MAX_MARKERS', 5000))
+
+# Zoom initial de la carte d'un arrondissement et de la carte de toute la ville
+DEFAULT_ZOOM = 12.5
+CITY_ZOOM = 10
+
+# Niveau de détail des arbres affichés un par un
+POINTS = -1
+
+# Côté des seaux de l'index spatial, en degrés de latitude
+BUCKET_SIZE = 0.004
+
+# Taille approximative de la carte à l'écran en pixels, quand le rectangle visible n'est pas connu
+MAP_PIXELS = (700, 450)
+
+
+def build_grid(df):
+    latitude = df['Latitude'].to_numpy()
+    longitude = df['Longitude'].to_numpy()
+    lat0, lon0 = np.floor(latitude.min()) if len(df) else 0, np.floor(longitude.min()) if len(df) else 0
+
+    # Cellules carrées au sol : la largeur en longitude est corrigée par la latitude moyenne
+    lon_scale = 1 / np.cos(np.radians(latitude.mean())) if len(df) else 1
+    cells = []
+    for size in GRID_SIZES:
+        rows = np.floor((latitude - lat0) / size).astype(np.int64)
+        columns = np.floor((longitude - lon0) / (size * lon_scale)).astype(np.int64)
+        cells.append((rows * (int(columns.max(initial=0)) + 1) + columns).astype(np.int32))
+
+    return {'sizes': GRID_SIZES, 'cells': cells}
+
+
+def build_spatial_index(df):
+    latitude = df['Latitude'].to_numpy()
+    longitude = df['Longitude'].to_numpy()
+    lat0, lon0 = np.floor(latitude.min()) if len(df) else 0, np.floor(longitude.min()) if len(df) else 0
+    lon_size = BUCKET_SIZE / np.cos(np.radians(latitude.mean())) if len(df) else BUCKET_SIZE
+    rows = np.floor((latitude - lat0) / BUCKET_SIZE).astype(np.int64)
+    columns = np.floor((longitude - lon0) / lon_size).astype(np.int64)
+    nb_rows, nb_columns = int(rows.max(initial=0)) + 1, int(columns.max(initial=0)) + 1
+
+    # Arbres triés par seau et début de chaque seau dans cet ordre
+    buckets = rows * nb_columns + columns
+    order = np.argsort(buckets, kind='stable').astype(np.int32)
+    offsets = np.searchsorted(buckets[order], np.arange(nb_rows * nb_columns + 1))
+
+    return {'latitude': latitude, 'longitude': longitude, 'lat0': lat0, 'lon0': lon0, 'lon_size': lon_size,
+            'shape': (nb_rows, nb_columns), 'order': order, 'offsets': offsets}
+
+
+def query_bbox(spatial_index, bbox):
+    # Positions (triées) des arbres dans le rectangle (ouest, sud, est, nord)
+    west, south, east, north = bbox
+    nb_rows, nb_columns = spatial_index['shape']
+    row_low = max(int(np.floor((south - spatial_index['lat0']) / BUCKET_SIZE)), 0)
+    row_high = min(int(np.floor((north - spatial_index['lat0']) / BUCKET_SIZE)), nb_rows - 1)
+    column_low = max(int(np.floor((west - spatial_index['lon0']) / spatial_index['lon_size'])), 0)
+    column_high = min(int(np.floor((east - spatial_index['lon0']) / spatial_index['lon_size'])), nb_columns - 1)
+    if row_low > row_high or column_low > column_high:
+        return np.empty(0, dtype=np.int32)
+
+    # Une tranche des arbres triés par rangée de seaux, puis le test exact sur les seaux du bord
+    offsets = spatial_index['offsets']
+    slices = [spatial_index['order'][offsets[row * nb_columns + column_low]:offsets[row * nb_columns + column_high + 1]]
+              for row in range(row_low, row_high + 1)]
+    rows = np.concatenate(slices)
+
+    return np.sort(crop(spatial_index, rows, bbox))
+
+
+def crop(spatial_index, rows, bbox):
+    # Garde les positions des arbres qui sont dans le rectangle (ouest, sud, est, nord)
+    west, south, east, north = bbox
+    latitude, longitude = spatial_index['latitude'][rows], spatial_index['longitude'][rows]
+
+    return rows[(longitude >= west) & (longitude <= east) & (latitude >= south) & (latitude <= north)]
+
+
+def get_viewport(relayout_data):
+    # Rectangle visible de la carte d'après son relayoutData, élargi de moitié de chaque côté et arrondi
+    # aux cellules de la grille la plus grossière (de petits déplacements redonnent le même rectangle)
+    if not relayout_data:
+        return None
+    coordinates = (relayout_data.get('mapbox._derived') or {}).get('coordinates')
+    if coordinates:
+        longitudes, latitudes = [c[0] for c in coordinates], [c[1] for c in coordinates]
+        west, east, south, north = min(longitudes), max(longitudes), min(latitudes), max(latitudes)
+    elif 'mapbox.center' in relayout_data and 'mapbox.zoom' in relayout_data:
+        center = relayout_data['mapbox.center']
+        degrees_per_pixel = 360 / (256 * 2**relayout_data['mapbox.zoom'])
+        half_width = MAP_PIXELS[0] * degrees_per_pixel / 2
+        half_height = MAP_PIXELS[1] * degrees_per_pixel * np.cos(np.radians(center['lat'])) / 2
+        west, east = center['lon'] - half_width, center['lon'] + half_width
+        south, north = center['lat'] - half_height, center['lat'] + half_height
+    else:
+        return None
+
+    margin_x, margin_y = (east - west) / 2, (north - south) / 2
+    step = GRID_SIZES[0]
+    return (float(np.floor((west - margin_x) / step) * step), float(np.floor((south - margin_y) / step) * step),
+            float(np.ceil((east + margin_x) / step) * step), float(np.ceil((north + margin_y) / step) * step))
+
+
+def get_zoom(relayout_data, default=DEFAULT_ZOOM):
+    # Zoom courant de la carte d'après son relayoutData
+    if relayout_data and 'mapbox.zoom' in relayout_data:
+        return relayout_data['mapbox.zoom']
+
+    return default
+
+
+def get_lod(zoom):
+    # Niveau de détail pour un zoom : POINTS ou l'indice de la grille dont les cellules font environ CELL_PIXELS
+    if zoom >= POINTS_ZOOM:
+        return POINTS
+    pixels_per_degree = 256 * 2**zoom / 360
+    for level, size in enumerate(GRID_SIZES):
+        if size * pixels_per_degree < CELL_PIXELS:
+            return max(level - 1, 0)
+
+    return len(GRID_SIZES) - 1
+
+
+def get_level(grid, rows, lod):
+    # Grille réellement utilisée : on passe à une grille plus grossière tant que le budget de marqueurs est dépassé
+    if lod == POINTS:
+        if len(rows) <= MAX_MARKERS:
+            return POINTS
+        lod = len(GRID_SIZES) - 1
+    for level in range(lod, 0, -1):
+        if len(np.unique(grid['cells'][level][rows])) <= MAX_MARKERS:
+            return level
+
+    return 0
+
+
+def cluster(grid, rows, data, values, level):
+    # Regroupe les arbres (positions rows, lignes de data) par cellule de la grille
+    cells, inverse = np.unique(grid['cells'][level][rows], return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(cells))
+    clusters = pd.DataFrame({
+        'Latitude': np.bincount(inverse, weights=data['Latitude'].to_numpy(), minlength=len(cells)) / counts,
+        'Longitude': np.bincount(inverse, weights=data['Longitude'].to_numpy(), minlength=len(cells)) / counts,
+        'Nombre_Arbres': counts,
+        'Moyenne': np.bincount(inverse, weights=np.asarray(values, dtype=np.float64), minlength=len(cells)) / counts,
+    })
+
+    return clusters
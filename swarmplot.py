@@ -1,120 +1,134 @@
+import hashlib
+import inspect
+import os
+
 import plotly.graph_objects as go
 import numpy as np
 import pandas as pd
-from scipy.stats import linregress
 
-# Calcule la vitesse moyenne de croissance du tronc des espèces d'arbres
-def getGrowthPerSpecie(data):
-    try:
-        a, _, _, _, _ =  linregress(data['Age'], data['DHP'])
-    except:
-        tree = data.iloc[0]
-        a = tree['DHP'] / tree['Age']
-    return round(a*365,2)
+import growth_stats
+import preprocess
 
-# Calcule le diamètre de tronc moyen des espèces d'arbres 
-def getMeanDHPPerSpecie(data):
-    return data['DHP'].mean()
+# Calcule les positions y des bulles : chaque bulle est placée, dans l'ordre, à la première position
+# k * ystep (dans une direction aléatoire) où elle ne chevauche aucune bulle déjà placée.
+# Toutes les ellipses ont le même rapport hauteur/largeur : en multipliant les x par ratio, elles deviennent
+# des cercles et deux bulles se chevauchent si la distance entre leurs centres est au plus la somme de leurs rayons.
+# Chaque voisin interdit donc un intervalle de y, et la première position libre est soit 0, soit juste après
+# la fin d'un de ces intervalles.
+def swarmLayout(x, size, ratio, ystep=0.5, seed=1):
+    directions = np.random.RandomState(seed).choice([1, -1], size=len(x))
+    rmax = size.max() if len(size) > 0 else 0
+    order = np.argsort(x, kind='stable')
+    xSorted = x[order]
+    y = np.zeros(len(x))
+    for i, (xi, ri, direction) in enumerate(zip(x, size, directions)):
+        # Voisins déjà placés assez proches en x pour chevaucher la bulle
+        window = order[np.searchsorted(xSorted, xi - 2*rmax/ratio, side='right'):np.searchsorted(xSorted, xi + 2*rmax/ratio, side='left')]
+        close = window[window < i]
+        reach = (ri + size[close])**2 - (ratio*(x[close] - xi))**2
+        close, reach = close[reach >= 0], reach[reach >= 0]
+        if len(close) == 0:
+            continue
 
-# Crée un swarmplot des espèces d'arbres avec la taille de bulle selon le diamètre de tronc moyen 
-# et la position le long de l'axe des abscisses selon la vitesse moyenne de croissance du tronc
-def swarm(data, figSize=(1400, 500), xmin=0, xmax=5, ymin=-25, ymax=25, ystep=0.5, color='#36749d', seed=1):
-    np.random.seed(seed)
-    
-    # Pour chaque espèce, on calcule sa vitesse moyenne de croissance du tronc et diamètre de tronc moyen
-    uniqueSpecies = pd.unique(data['Essence_fr'])
-    species = []
-    growth = []
-    meanDHP = []
-    nbTrees = []
-    for specie in uniqueSpecies:
-        buffer = data[data['Essence_fr'] == specie]
-        buffer = buffer[['Date_plantation', 'Date_releve', 'DHP']].dropna()
-        buffer['Age'] = (buffer['Date_releve'] - buffer['Date_plantation']).dt.days
-        buffer = buffer[buffer['Age'] > 0]
-        if len(buffer) > 0:
-            nbTrees.append(len(buffer))
-            species.append(specie)
-            growth.append(getGrowthPerSpecie(buffer))
-            meanDHP.append(getMeanDHPPerSpecie(buffer))
+        # Intervalles de pas k interdits par chaque voisin
+        yClose = direction*y[close]
+        half = np.sqrt(reach)
+        low = np.maximum(np.ceil((yClose - half)/ystep), 0)
+        high = np.floor((yClose + half)/ystep)
+        low, high = low[low <= high], high[low <= high]
+
+        # Premier pas libre parmi 0 et les fins d'intervalles
+        candidates = np.append(0, high + 1)
+        covered = ((candidates[:, None] >= low[None, :]) & (candidates[:, None] <= high[None, :])).any(axis=1)
+        y[i] = candidates[~covered].min()*ystep*direction
+
+    return y
+
+# Statistiques des espèces du swarmplot, sans les outliers (stats : résultat de growth_stats.get_species_stats s'il est déjà calculé)
+def getSwarmData(data, stats=None, version=None):
+    if stats is None:
+        stats = growth_stats.get_species_stats(data, version=version)
     
-    # On retire les outliers
-    swarm = pd.DataFrame({'specie': species, 'growth':growth, 'dhp':meanDHP, 'trees':nbTrees}).dropna()
+    # On retire les outliers (l'intervalle de confiance peut manquer : espèce d'un seul arbre)
+    swarm = stats.dropna(subset=['growth', 'dhp'])
     swarm = swarm[(swarm['growth'] > 0) & (swarm['growth'] < 5)]
     maxDHP = swarm['dhp'].max()
     swarm = swarm[swarm['dhp'] > maxDHP/10]
+    
+    return swarm.sort_values('dhp', ascending=False).reset_index(drop=True)
+
+# Hash du code des positions des bulles : un swarmplot en cache calculé avec un autre code n'est pas repris
+LAYOUT_VERSION = hashlib.sha1(''.join(inspect.getsource(function) for function in (getSwarmData, swarmLayout)).encode('utf-8')).hexdigest()[:16]
+
+# Crée un swarmplot des espèces d'arbres avec la taille de bulle selon le diamètre de tronc moyen 
+# et la position le long de l'axe des abscisses selon la vitesse moyenne de croissance du tronc.
+# Si la version du jeu de données est donnée, les espèces et leurs positions sont gardées en cache sur le disque.
+# Les bulles sont dessinées par une seule trace de marqueurs ; avec renderer='shapes', par une forme par espèce (plus lent).
+# stats permet de fournir les statistiques des espèces déjà calculées par growth_stats.get_species_stats.
+def swarm(data, figSize=(1400, 500), xmin=0, xmax=5, ymin=-25, ymax=25, ystep=0.5, color='#36749d', seed=1, version=None, cache_dir=preprocess.SNAPSHOT_DIR, renderer='markers', stats=None):
+    # Ratio de hauteur/largeur des bulles
+    ratio = figSize[0]*(ymax-ymin)/((figSize[1]-50)*(xmax-xmin))
+    
+    cache_path = None
+    if version is not None:
+        key = hashlib.sha1(repr((version, LAYOUT_VERSION, growth_stats.CODE_VERSION, growth_stats.BOOTSTRAP, growth_stats.CONFIDENCE, figSize, xmin, xmax, ymin, ymax, ystep, seed)).encode('utf-8')).hexdigest()[:16]
+        cache_path = os.path.join(cache_dir, f'swarm-{key}.feather')
+    
+    if cache_path is not None and os.path.exists(cache_path):
+        swarm = pd.read_feather(cache_path)
+    else:
+        # Pour chaque espèce, on calcule sa vitesse moyenne de croissance du tronc, son intervalle de confiance et diamètre de tronc moyen
+        swarm = getSwarmData(data, stats, version)
+        # Calcul des positions y des bulles
+        swarm['y'] = swarmLayout(swarm['growth'].to_numpy(), swarm['dhp'].to_numpy()/25, ratio, ystep, seed)
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            swarm.to_feather(tmp_path)
+            os.replace(tmp_path, cache_path)
     species = sorted(swarm['specie'])
     
-    # Calcul des tailles, positions x et couleurs des bulles
-    swarm = swarm.sort_values('dhp', ascending=False)
+    # Tailles, positions et couleurs des bulles
     x = swarm['growth'].to_numpy()
+    y = swarm['y'].to_numpy()
     size = swarm['dhp'].to_numpy()/25
     mean_growth = swarm['growth'].mean()
     colors = swarm['specie'].apply(lambda x: color)
-    
-    # Ratio de hauteur/largeur des bulles
-    ratio = figSize[0]*(ymax-ymin)/((figSize[1]-50)*(xmax-xmin))
-    
-    def isInEllipse(x, y, x0, y0, r1, r2):
-        return ((x-x0)/r1)**2 + ((y-y0)/r2)**2 <= 1
-
-    def isOverlapping(x1, y1, r1, x2, y2, r2):
-        r12, r22 = r1, r2
-        r1, r2 = r12/ratio, r22/ratio
-        if isInEllipse(x1, y1, x2, y2, r2, r22) or isInEllipse(x2, y2, x1, y1, r1, r12):
-            return True
-
-        theta = np.arctan((y2-y1)/(x2-x1))
-        if x2 < x1:
-            theta += np.pi
-        x3 = r1*r12 / np.sqrt(r12**2 + (r1*np.tan(theta))**2)
-        if x2 < x1:
-            x3 = -x3
-        y3 = y1 + x3*np.tan(theta)
-        x3 = x1 + x3
-        return isInEllipse(x3, y3, x2, y2, r2, r22) 
-
-    def anyOverlapping(x, y, r, xClose, yClose, rClose):
-        for x2, y2, r2 in zip(xClose, yClose, rClose):
-            if isOverlapping(x, y, r, x2, y2, r2):
-                return True
-        return False
-
-    # Calcul des positions y des bulles
-    rmax = size.max()
-    indexes = np.arange(len(x))
-    y = []
-    for xi, ri in zip(x, size):
-        yi = 0
-        dir = np.random.choice([1, -1])
-        closeIndexes = indexes[np.abs(x - xi) < 2*rmax/ratio]
-        closeIndexes = closeIndexes[closeIndexes < len(y)]
-        xClose = x[closeIndexes] if len(closeIndexes) > 0  else []
-        yClose = np.array(y)[closeIndexes] if len(closeIndexes) > 0  else []
-        rClose = size[closeIndexes] if len(closeIndexes) > 0  else []
-        while anyOverlapping(xi, yi, ri, xClose, yClose, rClose):
-            yi+=ystep*dir
-        y.append(yi)
+    swarm = swarm.drop(columns=['y'])
 
     # Création du swarmplot
     fig = go.Figure()
-    kwargs = {'type': 'circle', 'xref': 'x', 'yref': 'y'}
-    points = [go.layout.Shape(x0=x-r/ratio, y0=y-r, x1=x+r/ratio, y1=y+r, fillcolor=c, line=dict(width=1, color='black'), **kwargs) for x, y, r, c in zip(x, y, size, colors)]
-    fig.update_layout(shapes=points, width=figSize[0], height=figSize[1], margin=dict(l=20, r=20, t=20, b=20), hoverlabel_bgcolor='rgb(42, 63, 95)', dragmode=False)
+    fig.update_layout(width=figSize[0], height=figSize[1], margin=dict(l=20, r=20, t=20, b=20), hoverlabel_bgcolor='rgb(42, 63, 95)', dragmode=False)
     fig.update_xaxes(range=[xmin, xmax])  
     fig.update_yaxes(range=[ymin, ymax], tickvals=[])
+    if renderer == 'shapes':
+        kwargs = {'type': 'circle', 'xref': 'x', 'yref': 'y'}
+        points = [go.layout.Shape(x0=x-r/ratio, y0=y-r, x1=x+r/ratio, y1=y+r, fillcolor=c, line=dict(width=1, color='black'), **kwargs) for x, y, r, c in zip(x, y, size, colors)]
+        fig.update_layout(shapes=points)
+        # Les hovers passent par une trace de marqueurs invisibles
+        marker = dict(size=size*0)
+    else:
+        # Diamètre des marqueurs en pixels : même conversion que pour le ratio des ellipses
+        marker = dict(size=2*size*(figSize[1]-50)/(ymax-ymin), sizemode='diameter', color=colors, opacity=1,
+                      line=dict(width=1, color='black'))
     
-    # Ajout des hovers
+    # Intervalle de confiance affiché dans les hovers (absent pour une espèce d'un seul arbre, ou sans rééchantillonnage)
+    interval = [f'[{low:.2f} ; {high:.2f}] cm/an' if high >= low else 'non disponible (un seul arbre)' if trees < 2 else 'non disponible'
+                for low, high, trees in zip(swarm['growth_low'], swarm['growth_high'], swarm['trees'])]
+
+    # Ajout des hovers (meta garde les positions y, pour masquer des bulles dans le navigateur puis les rétablir)
     fig.add_trace(go.Scatter(
         x=x,
         y=y,
         mode='markers',
-        marker=dict(size=size*0),
-        customdata=swarm[['specie', 'growth', 'dhp', 'trees']],
+        marker=marker,
+        customdata=swarm[['specie', 'growth', 'dhp', 'trees', 'growth_low', 'growth_high']].assign(interval=interval),
+        meta={'y': y},
         hovertemplate=('<b>Espèce</b> : %{customdata[0]}<br>' +
                       '<b>Nombre d\'arbres</b> : %{customdata[3]}<br>' +
                       '<b>Diamètre du tronc moyen</b> : %{customdata[2]:.2f} cm<br>' +
-                      '<b>Vitesse de croissance du tronc</b> : %{customdata[1]:.2f} cm/an<br>'
+                      '<b>Vitesse de croissance du tronc</b> : %{customdata[1]:.2f} cm/an<br>' +
+                      f'<b>Intervalle de confiance à {growth_stats.CONFIDENCE*100:g} %</b> : %{{customdata[6]}}<br>'
                       ) + "<extra></extra>"
     ))
 
@@ -131,15 +145,3 @@ def swarm(data, figSize=(1400, 500), xmin=0, xmax=5, ymin=-25, ymax=25, ystep=0.
                   annotation_position='top right')
     
     return fig, species, swarm
-
-# Met en évidence une espèce d'arbre en grisant toutes les autres espèces
-def swarmPlot(fig, swarm, highlight_specie=None, color='#36749d'):
-    if highlight_specie:
-        colors = swarm['specie'].apply(lambda x: color if x == highlight_specie else 'lightgray')
-    else:
-        colors = swarm['specie'].apply(lambda x: color)
-        
-    for i, color in enumerate(colors):
-        fig.layout.shapes[i].fillcolor = color
-    
-    return fig
\ No newline at end of file
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import count_cube
+import preprocess
+
+
+@pytest.fixture(scope='module')
+def trees():
+    # Arbres synthétiques : plusieurs arrondissements, une espèce courante (sommes cumulées du cube) et une
+    # espèce rare (liste des arbres), des dates au 1er janvier (bornes exactes des filtres) et des DHP entiers ou non
+    rng = np.random.default_rng(0)
+    n = 20000
+    districts = np.array(['Verdun', 'Outremont', 'LaSalle', 'Anjou'])
+    district = rng.integers(0, len(districts), n)
+    species = np.where(rng.random(n) < 0.999, 'Érable', 'Ginkgo')
+    dates = pd.to_datetime('1950-01-01') + pd.to_timedelta(rng.integers(0, 75 * 365, n), unit='D')
+    dates = dates.where(rng.random(n) > 0.05, dates.normalize().to_period('Y').to_timestamp())
+    dhp = rng.integers(1, 60, n) + np.where(rng.random(n) < 0.3, 0.5, 0)
+
+    return pd.DataFrame({'ARROND': district + 1, 'ARROND_NOM': districts[district], 'Essence_fr': species,
+                         'Date_plantation': dates, 'DHP': dhp})
+
+
+@pytest.mark.parametrize('specie', [None, 'Érable', 'Ginkgo'])
+@pytest.mark.parametrize('dhp_range', [(0, 300), (10, 40), (5.5, 30)])
+@pytest.mark.parametrize('date_range', [(1990, 2010), (1960, 2023), (2000, 2000)])
+def test_cumulative_counts_match_static_map(trees, specie, dhp_range, date_range):
+    cube = count_cube.build_count_cube(trees)
+    years = np.arange(date_range[0], date_range[1] + 1)
+    counts = count_cube.get_cumulative_counts(cube, trees, years, *dhp_range, specie)
+
+    # Chaque année de l'animation est la carte statique de la première année du curseur à cette année
+    for column, year in enumerate(years):
+        static = count_cube.get_nb_trees_district(cube, trees, pd.Timestamp(year=int(years[0]), month=1, day=1),
+                                                  pd.Timestamp(year=int(year) + 1, month=1, day=1), *dhp_range, specie)
+        expected = static.set_index('ARROND_NOM')['Nombre_Arbres'].reindex(cube['districts']['ARROND_NOM'], fill_value=0)
+        assert counts[:, column].tolist() == expected.tolist()
+
+    # La dernière image est la carte sans animation, comptée aussi en parcourant les données
+    scan = preprocess.get_nb_trees_district(trees, pd.Timestamp(year=date_range[0], month=1, day=1),
+                                            pd.Timestamp(year=date_range[1] + 1, month=1, day=1), *dhp_range, specie)
+    assert counts[:, -1].sum() == scan['Nombre_Arbres'].sum()
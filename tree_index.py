@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+# Index des arbres construit au chargement pour les vues d'un arrondissement.
+#
+# Les arbres de chaque arrondissement sont triés par date de plantation : un intervalle de dates
+# correspond alors à une tranche obtenue par recherche dichotomique. Pour chaque espèce, on garde
+# la liste triée des rangs de ses arbres dans cet ordre, ce qui donne directement l'intersection
+# espèce x dates. Un second ordre par DHP permet de partir de la tranche la plus petite quand
+# seul le diamètre est restrictif. Les requêtes ne touchent que les arbres qu'elles retournent.
+
+
+def build_tree_index(df):
+    dates = df['Date_plantation'].to_numpy(dtype='datetime64[ns]').view('int64')
+    dhp = df['DHP'].to_numpy()
+    district_codes, district_names = pd.factorize(df['ARROND_NOM'])
+    species_codes, species_names = pd.factorize(df['Essence_fr'])
+    species_names = np.asarray(species_names)
+
+    # Arbres triés par arrondissement puis par date de plantation (les arbres sans arrondissement sont ignorés)
+    order = np.lexsort((dates, district_codes))
+    order = order[district_codes[order] >= 0]
+    starts = np.searchsorted(district_codes[order], np.arange(len(district_names)), side='left')
+    ends = np.searchsorted(district_codes[order], np.arange(len(district_names)), side='right')
+
+    index = {'dates': dates, 'dhp': dhp, 'species_codes': species_codes,
+             'species': {name: code for code, name in enumerate(species_names)}, 'districts': {}}
+    for code, name in enumerate(np.asarray(district_names)):
+        rows = order[starts[code]:ends[code]].astype(np.int32)
+
+        # Listes des rangs (dans l'ordre des dates) des arbres de chaque espèce
+        ranks = np.argsort(species_codes[rows], kind='stable').astype(np.int32)
+        codes, bounds = np.unique(species_codes[rows][ranks], return_index=True)
+        bounds = np.append(bounds, len(ranks))
+        species = {species_names[c]: ranks[bounds[i]:bounds[i + 1]] for i, c in enumerate(codes)}
+
+        # Second ordre par DHP
+        dhp_rows = rows[np.argsort(dhp[rows], kind='stable')]
+
+        index['districts'][name] = {
+            'rows': rows,
+            'dates': dates[rows],
+            'species': species,
+            'dhp_rows': dhp_rows,
+            'dhp': dhp[dhp_rows],
+        }
+
+    return index
+
+
+def get_district_rows(index, arrondissement):
+    # Positions (dans l'ordre du DataFrame) de tous les arbres de l'arrondissement
+    district = index['districts'].get(arrondissement)
+    if district is None:
+        return np.empty(0, dtype=np.int32)
+
+    return np.sort(district['rows'])
+
+
+def query(index, arrondissement, filter):
+    # Positions (dans l'ordre du DataFrame) des arbres de l'arrondissement qui respectent le filtre
+    espece, min_date_plantation, max_date_plantation, min_dhp, max_dhp = filter
+    district = index['districts'].get(arrondissement)
+    if district is None:
+        return np.empty(0, dtype=np.int32)
+
+    # Tranche des dates de plantation
+    date_low, date_high = 0, len(district['rows'])
+    has_dates = min_date_plantation is not None and max_date_plantation is not None
+    if has_dates:
+        date_low = np.searchsorted(district['dates'], pd.Timestamp(min_date_plantation).value, side='left')
+        date_high = np.searchsorted(district['dates'], pd.Timestamp(max_date_plantation).value, side='right')
+
+    has_dhp = min_dhp is not None and max_dhp is not None
+    if espece:
+        # Intersection de la liste de l'espèce avec la tranche de dates
+        ranks = district['species'].get(espece, np.empty(0, dtype=np.int32))
+        ranks = ranks[np.searchsorted(ranks, date_low):np.searchsorted(ranks, date_high)]
+        rows = district['rows'][ranks]
+    else:
+        rows = district['rows'][date_low:date_high]
+
+        # On part de la tranche de DHP si elle est plus petite que la tranche de dates
+        if has_dhp:
+            dhp_low = np.searchsorted(district['dhp'], min_dhp, side='left')
+            dhp_high = np.searchsorted(district['dhp'], max_dhp, side='right')
+            if dhp_high - dhp_low < len(rows):
+                rows = district['dhp_rows'][dhp_low:dhp_high]
+                if has_dates:
+                    dates = index['dates'][rows]
+                    rows = rows[(dates >= pd.Timestamp(min_date_plantation).value) & (dates <= pd.Timestamp(max_date_plantation).value)]
+                return np.sort(rows)
+
+    # Filtre du DHP sur les arbres restants seulement
+    if has_dhp:
+        dhp = index['dhp'][rows]
+        rows = rows[(dhp >= min_dhp) & (dhp <= max_dhp)]
+
+    return np.sort(rows)
+
+
+def filter_rows(index, rows, filter):
+    # Garde, parmi des positions déjà triées (par exemple celles du rectangle visible), celles qui respectent le filtre
+    espece, min_date_plantation, max_date_plantation, min_dhp, max_dhp = filter
+    if espece:
+        rows = rows[index['species_codes'][rows] == index['species'].get(espece, -2)]
+    if min_date_plantation is not None and max_date_plantation is not None:
+        dates = index['dates'][rows]
+        rows = rows[(dates >= pd.Timestamp(min_date_plantation).value) & (dates <= pd.Timestamp(max_date_plantation).value)]
+    if min_dhp is not None and max_dhp is not None:
+        dhp = index['dhp'][rows]
+        rows = rows[(dhp >= min_dhp) & (dhp <= max_dhp)]
+
+    return rows